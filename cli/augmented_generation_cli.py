@@ -1,10 +1,19 @@
 import argparse
 import json
+import time
 
+from constants import SEARCH_SERVER_ENV
 from lib.hybrid_search import *
 from lib.query_enhancement import *
+from lib.search_client import RemoteHybridSearch, SearchClient, server_url
 
-from sentence_transformers import CrossEncoder
+def hybrid_search(args):
+    url = server_url(args.server)
+    if url:
+        return RemoteHybridSearch(SearchClient(url))
+    with open("data/movies.json", "r") as f:
+        documents = json.load(f)
+    return HybridSearch(documents["movies"])
 
 def main():
     parser = argparse.ArgumentParser(description="Retrieval Augmented Generation CLI")
@@ -14,28 +23,36 @@ def main():
         "rag", help="Perform RAG (search + generate answer)"
     )
     rag_parser.add_argument("query", type=str, help="Search query for RAG")
+    rag_parser.add_argument("--server", type=str, default=None, help=f"Search through a running search server (default: ${SEARCH_SERVER_ENV})")
+    add_llm_arguments(rag_parser)
 
     summarize_parser = subparsers.add_parser("summarize", help="Summarize results by use of LLM.")
     summarize_parser.add_argument("query",type=str,help="Search query for summarization")
     summarize_parser.add_argument("--limit",type=int,default=5,help="limit search")
+    summarize_parser.add_argument("--server",type=str,default=None,help=f"Search through a running search server (default: ${SEARCH_SERVER_ENV})")
+    add_llm_arguments(summarize_parser)
 
     citation_parser = subparsers.add_parser("citations", help="Add citations")
     citation_parser.add_argument("query",type=str,help="Search query to add citations for")
     citation_parser.add_argument("--limit",type=int,default=5,help="limit search")
+    citation_parser.add_argument("--server",type=str,default=None,help=f"Search through a running search server (default: ${SEARCH_SERVER_ENV})")
+    add_llm_arguments(citation_parser)
 
     question_parser = subparsers.add_parser("question",help="Ask a question and you will be answered")
     question_parser.add_argument("query",type=str,help="Question to ask")
     question_parser.add_argument("--limit",type=int,default=5,help="limit search")
+    question_parser.add_argument("--server",type=str,default=None,help=f"Search through a running search server (default: ${SEARCH_SERVER_ENV})")
+    add_llm_arguments(question_parser)
 
     args = parser.parse_args()
+    configure_llm(args)
+    start = time.perf_counter()
 
     match args.command:
         case "rag":
             query = args.query
             # do RAG stuff here
-            with open("data/movies.json", "r") as f:
-                documents = json.load(f)
-            search = HybridSearch(documents["movies"])
+            search = hybrid_search(args)
             results = search.rrf_search(query,60,5)
 
             prompt = rag_results(query,results)
@@ -51,9 +68,7 @@ def main():
             print(response)
 
         case "summarize":
-            with open("data/movies.json", "r") as f:
-                documents = json.load(f)
-            search = HybridSearch(documents["movies"])
+            search = hybrid_search(args)
             results = search.rrf_search(args.query,60,args.limit)
 
             prompt = summarize_results(args.query,results)
@@ -69,9 +84,7 @@ def main():
             print(response)
 
         case "citations":
-            with open("data/movies.json", "r") as f:
-                documents = json.load(f)
-            search = HybridSearch(documents["movies"])
+            search = hybrid_search(args)
             results = search.rrf_search(args.query,60,args.limit)
 
             prompt = citation_results(args.query,results)
@@ -87,9 +100,7 @@ def main():
             print(response)
 
         case "question":
-            with open("data/movies.json", "r") as f:
-                documents = json.load(f)
-            search = HybridSearch(documents["movies"])
+            search = hybrid_search(args)
             results = search.rrf_search(args.query,60,args.limit)
 
             prompt = question_results(args.query,results)
@@ -107,6 +118,9 @@ def main():
         case _:
             parser.print_help()
 
+    if getattr(args,"llm_stats",False):
+        print_llm_stats(time.perf_counter()-start)
+
 
 if __name__ == "__main__":
     main()
@@ -1,3 +1,57 @@
 BM25_K1 = 1.5
 BM25_B = 0.75
 SCORE_PRECISION = 4
+BM25_BLOCK_SIZE = 128
+PROBE_RATIO = 8
+BM25_PRUNED_FALLBACK_COVERAGE = 0.4
+BM25_PRUNED_FALLBACK_LIMIT_RATIO = 0.005
+BM25_IMPACT_BITS = (8,16)
+SEGMENT_MAX_COUNT = 8
+SEGMENT_MERGE_FACTOR = 4
+TOKENIZE_BATCH_SIZE = 1024
+STEM_CACHE_SIZE = 100_000
+INDEX_SHARD_SIZE = 8192
+CORPUS_READ_SIZE = 1 << 16
+EMBED_BATCH_SIZE = 256
+ANN_NPROBE = 8
+ANN_LISTS_PER_SQRT = 4
+ANN_TRAIN_PER_LIST = 64
+ANN_KMEANS_ITERATIONS = 20
+ANN_ASSIGN_BATCH_SIZE = 8192
+EMBEDDING_SCORE_BATCH_SIZE = 1024
+EMBEDDING_RESCORE_FACTOR = 4
+PQ_SUBSPACES = 48
+PQ_TRAIN_PER_CENTROID = 64
+PQ_KMEANS_ITERATIONS = 15
+QUERY_CACHE_SIZE = 4096
+QUERY_CACHE_PATH = "cache/query_embeddings.sqlite"
+SEARCH_SERVER_HOST = "127.0.0.1"
+SEARCH_SERVER_PORT = 8765
+SEARCH_SERVER_ENV = "RAGSEARCH_SERVER"
+SEARCH_CLIENT_TIMEOUT = 600
+CLI_IMPORT_BUDGET_MS = 150
+HYBRID_SEARCH_WORKERS = 4
+QUERY_BATCH_SIZE = 64
+BM25_QUERY_BATCH_SIZE = 32
+EVALUATION_WORKERS = 4
+SYNTHETIC_VOCABULARY_SIZE = 20000
+SYNTHETIC_BLOCK_SIZE = 10000
+SYNTHETIC_EMBEDDING_ROWS = 1 << 14
+SCALING_EXPONENT_LIMIT = 1.2
+SCALING_NOISE_FLOOR_MS = 1.0
+LLM_CONCURRENCY = 8
+LLM_REQUESTS_PER_SECOND = 0.5
+LLM_BURST = 10
+LLM_MAX_RETRIES = 4
+LLM_REQUEST_TIMEOUT = 60
+LLM_BACKOFF_SECONDS = 2.0
+LLM_MODEL = "gemma-3-27b-it"
+LLM_CACHE_PATH = "cache/llm_responses.sqlite"
+LLM_CACHE_TTL = 7*24*3600
+LLM_CACHE_SIZE = 10000
+LLM_CACHE_ENV = "RAGSEARCH_LLM_CACHE"
+LLM_BACKEND = "gemini"
+LLM_BACKEND_ENV = "RAGSEARCH_LLM_BACKEND"
+LLM_LOCAL_LATENCY = 0.5
+LLM_LOCAL_LATENCY_ENV = "RAGSEARCH_LLM_LATENCY"
+LLM_LOCAL_IMAGE_TOKENS = 258
@@ -0,0 +1,112 @@
+import json
+
+from constants import *
+
+NUMBER_CHARS = ".eE+-0123456789"
+
+def iter_movies(path="data/movies.json"):
+    # yields one movie at a time from either {"movies": [...]}, a bare JSON
+    # array or JSON lines, so a corpus never has to fit in memory at once
+    with open(path,"r",encoding="utf-8") as f:
+        reader = JsonStream(f)
+        first = reader.peek()
+        if first == "[":
+            yield from reader.array_items()
+        elif first == "{" and not path.endswith(".jsonl"):
+            found = yield from reader.object_array("movies")
+            if not found:
+                # the first value was a record, not a wrapper: JSON lines
+                f.seek(0)
+                yield from JsonStream(f).lines()
+            elif reader.peek():
+                raise ValueError(f"Malformed JSON corpus: {path} has content after the top-level object")
+        elif first:
+            yield from reader.lines()
+
+class JsonStream():
+    def __init__(self,f,chunk_size=CORPUS_READ_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def __fill(self):
+        # drops the consumed prefix so the buffer only ever holds the
+        # current value plus one chunk
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.__fill():
+                return ""
+
+    def expect(self,char):
+        if self.peek() != char:
+            raise ValueError(f"Malformed JSON corpus: expected {char!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value,end = self.decoder.raw_decode(self.buf,self.pos)
+            except json.JSONDecodeError:
+                if not self.__fill():
+                    raise
+                continue
+            # a number followed by nothing but number characters may have been
+            # cut at the chunk boundary ("1." or "2e" decode as a shorter one)
+            if not self.eof and self.buf[self.pos] not in "{[\"" and self.buf[end:].strip(NUMBER_CHARS) == "":
+                if self.__fill():
+                    continue
+            self.pos = end
+            return value
+
+    def array_items(self):
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == "]":
+                self.pos += 1
+                return
+            self.expect(",")
+
+    def object_array(self,key):
+        # walks the top-level object and streams the array under key; other
+        # members are decoded whole and skipped. Returns whether key was there
+        self.expect("{")
+        found = False
+        if self.peek() == "}":
+            self.pos += 1
+            return found
+        while True:
+            name = self.value()
+            self.expect(":")
+            if name == key:
+                found = True
+                yield from self.array_items()
+            else:
+                self.value()
+            if self.peek() == "}":
+                self.pos += 1
+                return found
+            self.expect(",")
+
+    def lines(self):
+        while self.peek():
+            yield self.value()
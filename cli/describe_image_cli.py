@@ -1,26 +1,19 @@
 import argparse
 import mimetypes
-import os
+import time
 
-from dotenv import load_dotenv
-from google import genai
-from google.genai import types
+from lib.query_enhancement import add_llm_arguments, configure_llm, get_llm_backend, print_llm_stats
 
 MODEL = "gemini-2.5-flash"
 
-load_dotenv()
-api_key = os.environ.get("GEMINI_API_KEY")
-
-if not api_key:
-    raise RuntimeError("GEMINI_API_KEY environment variable not set")
-
-
-
 def main():
     parser = argparse.ArgumentParser(description="Multimodal query rewriting")
     parser.add_argument("--image",required=True,help="Insert path to image to process")
     parser.add_argument("--query", required=True, type=str, help="Query to pass to model")
+    add_llm_arguments(parser)
     args = parser.parse_args()
+    configure_llm(args)
+    start = time.perf_counter()
 
     mime,_ = mimetypes.guess_type(args.image)
     mime = mime or "image/jpeg"
@@ -28,19 +21,19 @@ def main():
     with open(args.image, "rb") as f:
         img = f.read()
 
-    client = genai.Client(api_key=api_key)
-
     system_prompt = """Given the included image and text query, rewrite the text query to improve search results from a movie database. Make sure to:
         - Synthesize visual and textual information
         - Focus on movie-specific details (actors, scenes, style, etc.)
         - Return only the rewritten query, without any additional commentary"""
     
-    parts = [system_prompt,types.Part.from_bytes(data=img,mime_type=mime),args.query.strip(),]
-    response = client.models.generate_content(model=MODEL,contents=parts,)
-
-    print(f"Rewritten query: {response.text.strip()}")
-    if response.usage_metadata is not None:
-        print(f"Total tokens: {response.usage_metadata.total_token_count}")
+    # the backend creates its client, and checks the key, on this first request
+    parts = [system_prompt,(img,mime),args.query.strip(),]
+    response = get_llm_backend().generate(parts,MODEL)
+
+    print(f"Rewritten query: {response.text}")
+    print(f"Total tokens: {response.prompt_tokens+response.response_tokens}")
+    if args.llm_stats:
+        print_llm_stats(time.perf_counter()-start)
 
 if __name__ == "__main__":
     main()
@@ -1,7 +1,8 @@
 import argparse
 import json
 
-from lib.hybrid_search import HybridSearch
+from concurrent.futures import ThreadPoolExecutor
+from constants import *
 
 def main():
     parser = argparse.ArgumentParser(description="Search Evaluation CLI")
@@ -11,44 +12,66 @@ def main():
         default=5,
         help="Number of results to evaluate (k for precision@k, recall@k)",
     )
+    parser.add_argument("--k", type=int, default=60, help="RRF k parameter")
+    parser.add_argument("--workers", type=int, default=EVALUATION_WORKERS, help="Golden queries run at the same time")
+    parser.add_argument("--repeat", type=int, default=1, help="Passes over the golden dataset for the latency numbers")
+    parser.add_argument("--output", type=str, help="Write the report as JSON to this file")
+    parser.add_argument("--compare", type=str, help="JSON report of an earlier run to compare against")
 
     args = parser.parse_args()
     limit = args.limit
 
+    from lib.evaluation import compare_reports, evaluate
+    from lib.hybrid_search import HybridSearch
+
     # run evaluation logic here
     with open("data/movies.json", "r") as f:
         documents = json.load(f)
     with open("data/golden_dataset.json", "r") as f:
         golden = json.load(f)
-    
-    search = HybridSearch(documents["movies"])
+
+    # every query in flight keeps its BM25 leg on the pool as well
+    search = HybridSearch(documents["movies"],executor=ThreadPoolExecutor(max(args.workers,HYBRID_SEARCH_WORKERS)))
 
     print(f"\nk={limit}\n")
 
-    for case in golden["test_cases"]:
-        query = case["query"]
-        relevant = case["relevant_docs"]
-        relevant_set = set(relevant)
-        results = search.rrf_search(query,k=60,limit=limit)
-        retrieved_titles = [r["document"]["title"] for r in results]
-
-        top_k = retrieved_titles[:limit]
-
-        relevant_retrieved = sum(1 for title in top_k if title in relevant_set)
-        precision = relevant_retrieved/limit
-        recall = relevant_retrieved/len(relevant_set)
-
-        if precision == 0 and recall == 0:
-            f1 = 0.0
-        else:
-            f1 = 2*(precision*recall)/(precision+recall)
-
-        print(f"- Query: {query}")
-        print(f"  - Precision@{limit}: {precision:.4f}")
-        print(f"  - Recall@{limit}: {recall:.4f}")
-        print(f"  - F1 Score: {f1}")
-        print(f"  - Retrieved: {', '.join(retrieved_titles)}")
-        print(f"  - Relevant: {', '.join(relevant)}\n")
+    cases = golden["test_cases"]
+    report = evaluate(lambda query,timings: search.rrf_search(query,args.k,limit,timings=timings),
+                      cases,limit,args.workers,args.repeat)
+    report["config"] = {"limit": limit, "k": args.k, "workers": args.workers, "repeat": args.repeat,
+                        "bm25_mode": search.bm25_mode, "query_cache": search.semantic_search.query_cache.stats()}
+
+    for scores in report["per_query"]:
+        print(f"- Query: {scores['query']}")
+        print(f"  - Precision@{limit}: {scores['precision']:.4f}")
+        print(f"  - Recall@{limit}: {scores['recall']:.4f}")
+        print(f"  - F1 Score: {scores['f1']}")
+        print(f"  - MRR: {scores['mrr']:.4f}")
+        print(f"  - nDCG@{limit}: {scores['ndcg']:.4f}")
+        print(f"  - Retrieved: {', '.join(scores['retrieved'])}")
+        print(f"  - Relevant: {', '.join(scores['relevant'])}\n")
+
+    print(f"Mean over {report['queries']} queries:")
+    for metric,value in report["quality"].items():
+        print(f"  {metric:>9}: {value:.4f}")
+    print("Latency (ms):")
+    for stage,summary in report["latency_ms"].items():
+        print(f"  {stage:>9}: p50 {summary['p50']:8.2f}  p95 {summary['p95']:8.2f}  p99 {summary['p99']:8.2f}")
+    print(f"Throughput: {report['qps']:.2f} queries/s with {args.workers} workers")
+    print(f"Peak RSS: {report['peak_rss_mb']:.1f} MB")
+
+    if args.output:
+        with open(args.output,"w") as f:
+            json.dump(report,f,indent=2)
+        print(f"Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare,"r") as f:
+            baseline = json.load(f)
+        print(f"\nCompared to {args.compare}:")
+        for name,old,new in compare_reports(baseline,report):
+            change = f"{(new-old)/old*100:+.1f}%" if old else "n/a"
+            print(f"  {name:28} {old:10.4f} -> {new:10.4f}  {change}")
 
 if __name__ == "__main__":
     main()
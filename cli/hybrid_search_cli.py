@@ -1,10 +1,45 @@
 import argparse
 import json
+import time
 
+from constants import LLM_CONCURRENCY, LLM_REQUESTS_PER_SECOND, SEARCH_SERVER_ENV
 from lib.hybrid_search import *
 from lib.query_enhancement import *
-
-from sentence_transformers import CrossEncoder
+from lib.search_client import RemoteHybridSearch, SearchClient, server_url
+
+def hybrid_search(args):
+    url = server_url(args.server)
+    if url:
+        return RemoteHybridSearch(SearchClient(url),args.bm25_mode)
+    with open("data/movies.json", "r") as f:
+        documents = json.load(f)
+    return HybridSearch(documents["movies"],args.bm25_mode)
+
+def parse_score(text):
+    try:
+        return float(text)
+    except (TypeError,ValueError):
+        return 0.0
+
+def rerank_individual(query,results,concurrency,rate):
+    # one LLM request per candidate, sent side by side within the client's
+    # concurrency and rate limits; scores print as they come back
+    import asyncio
+    from lib.llm_client import AsyncLLMClient
+
+    async def score_all():
+        client = AsyncLLMClient(enhance_query,concurrency,rate)
+        prompts = [individual_reranking(query,result["document"]) for result in results]
+        async for position,response in client.stream(prompts):
+            result = results[position]
+            if isinstance(response,Exception):
+                print(f"   {result['document']['title']}: not scored ({response})")
+                response = None
+            result["rerank_score"] = parse_score(response)
+            print(f"   {result['document']['title']}: {result['rerank_score']:.1f}/10")
+
+    asyncio.run(score_all())
+    return sorted(results,key=lambda x: x["rerank_score"],reverse=True)
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Hybrid Search CLI")
@@ -15,6 +50,9 @@ def main() -> None:
     weighted.add_argument("query",type=str,help="Query to search for")
     weighted.add_argument("--alpha",type=float,default=0.5,help="Weight of semantic vs keyword")
     weighted.add_argument("--limit",type=int,default=5,help="limit search results")
+    weighted.add_argument("--bm25-mode",type=str,choices=BM25_MODES,default="exhaustive",help="BM25 top-k retrieval mode")
+    weighted.add_argument("--normalization",type=str,choices=FUSION_NORMALIZATIONS,default="minmax",help="How BM25 and semantic scores are put on one scale before weighting")
+    weighted.add_argument("--server",type=str,default=None,help=f"Search through a running search server (default: ${SEARCH_SERVER_ENV})")
     rrf = subparsers.add_parser("rrf-search",help="ranked search")
     rrf.add_argument("query",type=str,help="Query to search for")
     rrf.add_argument("-k",type=int,default=60,help="Ranking parameter")
@@ -22,22 +60,25 @@ def main() -> None:
     rrf.add_argument("--enhance",type=str,choices=["spell","rewrite","expand"],help="Enhance your search with an LLM")
     rrf.add_argument("--rerank-method",type=str,choices=["individual","batch","cross_encoder"],help="Rerank the enhanced search.")
     rrf.add_argument("--evaluate",action="store_true",help="evaluate results or not")
+    rrf.add_argument("--llm-concurrency",type=int,default=LLM_CONCURRENCY,help="LLM requests in flight at once when reranking individually")
+    rrf.add_argument("--llm-rate",type=float,default=LLM_REQUESTS_PER_SECOND,help="LLM requests started per second when reranking individually (0 = unlimited)")
+    rrf.add_argument("--bm25-mode",type=str,choices=BM25_MODES,default="exhaustive",help="BM25 top-k retrieval mode")
+    rrf.add_argument("--server",type=str,default=None,help=f"Search through a running search server (default: ${SEARCH_SERVER_ENV})")
+    add_llm_arguments(rrf)
     args = parser.parse_args()
+    configure_llm(args)
+    start = time.perf_counter()
 
     match args.command:
         case "normalize":
-            if args.score:
-                with open("data/movies.json", "r") as f:
-                    documents = json.load(f)
-                search = HybridSearch(documents["movies"])
-                search.normalize(args.score)
+            # pure arithmetic: no documents, index or model needed
+            for score in normalize_scores(args.score):
+                print(f"* {score:.4f}")
     
         case "weighted-search":
-            with open("data/movies.json", "r") as f:
-                documents = json.load(f)
-            search = HybridSearch(documents["movies"])
+            search = hybrid_search(args)
 
-            results = search.weighted_search(args.query,args.alpha,args.limit)
+            results = search.weighted_search(args.query,args.alpha,args.limit,args.normalization)
 
             for i, result in enumerate(results,1):
                 doc = result["document"]
@@ -70,9 +111,7 @@ def main() -> None:
                 case _:
                     query = args.query
             
-            with open("data/movies.json", "r") as f:
-                documents = json.load(f)
-            search = HybridSearch(documents["movies"])
+            search = hybrid_search(args)
             
             match args.rerank_method:
                 case "individual":
@@ -80,28 +119,7 @@ def main() -> None:
                     print(f"Reciprocal Rank Fusion Results for '{query}' (k={args.k}):")
 
                     results = search.rrf_search(query,args.k,args.limit*5)
-                    import time
-
-                    reranked = []
-
-                    for result in results:
-                        doc = result["document"]
-
-                        prompt = individual_reranking(query,doc) 
-                        
-                        score_text = enhance_query(prompt)
-
-                        try:
-                            score = float(score_text)
-                        except:
-                            score = 0.0
-
-                        result["rerank_score"] = score
-                        reranked.append(result)
-
-                        time.sleep(3)
-
-                    reranked = sorted(reranked,key=lambda x: x["rerank_score"],reverse=True)
+                    reranked = rerank_individual(query,results,args.llm_concurrency,args.llm_rate)
 
                     final = reranked[:args.limit]
 
@@ -173,9 +191,12 @@ def main() -> None:
                         doc = result["document"]
                         pairs.append([query, f"{doc.get('title', '')} - {doc.get('description', '')}"])
 
-                    cross_encoder = CrossEncoder("cross-encoder/ms-marco-TinyBERT-L2-v2")
-
-                    scores = cross_encoder.predict(pairs)
+                    if isinstance(search,RemoteHybridSearch):
+                        scores = search.client.call("cross-encode",pairs=pairs)
+                    else:
+                        from sentence_transformers import CrossEncoder
+                        cross_encoder = CrossEncoder("cross-encoder/ms-marco-TinyBERT-L2-v2")
+                        scores = cross_encoder.predict(pairs)
 
                     ranked = []
 
@@ -220,6 +241,9 @@ def main() -> None:
                 for i, (result,score) in enumerate(zip(results,scores),start=1):
                     print(f"{i}. {result['document']['title']}: {score}/3")
 
+            if args.llm_stats:
+                print_llm_stats(time.perf_counter()-start)
+
         case _:
             parser.print_help()
 
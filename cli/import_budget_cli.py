@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from constants import *
+
+CLI_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(CLI_DIR)
+
+# packages that take hundreds of milliseconds (or an API key) to import;
+# none of the cheap paths below may load them
+HEAVY_MODULES = ("torch","transformers","sentence_transformers","google.genai","PIL","nltk")
+
+# argument lists that must start fast: help output and
+# commands that need neither data files nor models
+COLD_START_PATHS = [
+    ["keyword_search_cli.py","--help"],
+    ["keyword_search_cli.py","bm25search","--help"],
+    ["semantic_search_cli.py","--help"],
+    ["semantic_search_cli.py","chunk","a b c d e","--chunk-size","2","--overlap","1"],
+    ["hybrid_search_cli.py","--help"],
+    ["hybrid_search_cli.py","normalize","0.5","2.5","1"],
+    ["augmented_generation_cli.py","--help"],
+    ["evaluation_cli.py","--help"],
+    ["multimodal_search_cli.py","--help"],
+    ["describe_image_cli.py","--help"],
+    ["search_server_cli.py","--help"],
+    ["scaling_benchmark_cli.py","--help"],
+    ["llm_benchmark_cli.py","--help"],
+]
+
+# runs a CLI as __main__ and reports every file it opened under data/
+BOOTSTRAP = """
+import atexit, json, os, runpy, sys
+data_dir = os.path.join(sys.argv[1], "data") + os.sep
+opened = []
+def audit(event, args):
+    if event == "open" and isinstance(args[0], str) and os.path.abspath(args[0]).startswith(data_dir):
+        opened.append(os.path.relpath(os.path.abspath(args[0]), sys.argv[1]))
+sys.addaudithook(audit)
+atexit.register(lambda: sys.stderr.write("data files: " + json.dumps(opened) + "\\n"))
+sys.argv = sys.argv[2:]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+def profile_path(argv):
+    # -X importtime writes "import time: self | cumulative | name" per module,
+    # nested imports indented under the module that triggered them
+    command = [sys.executable,"-X","importtime","-c",BOOTSTRAP,ROOT_DIR,os.path.join(CLI_DIR,argv[0])] + argv[1:]
+    completed = subprocess.run(command,cwd=ROOT_DIR,capture_output=True,text=True)
+    import_ms = 0.0
+    modules = set()
+    data_files = []
+    for line in completed.stderr.splitlines():
+        if line.startswith("data files: "):
+            data_files = json.loads(line[len("data files: "):])
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _,cumulative,name = line.split("|")
+        modules.add(name.strip())
+        if not name[1:].startswith(" "):
+            import_ms += int(cumulative)/1000
+    return {"argv": argv, "returncode": completed.returncode, "import_ms": import_ms,
+            "heavy": [m for m in HEAVY_MODULES if m in modules], "data_files": data_files}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check that CLI cold starts stay within the import budget")
+    parser.add_argument("--budget-ms", type=float, default=CLI_IMPORT_BUDGET_MS, help="Maximum import time per path in milliseconds")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per path; the fastest one is compared to the budget")
+    args = parser.parse_args()
+
+    failures = 0
+    for argv in COLD_START_PATHS:
+        runs = [profile_path(argv) for _ in range(args.repeat)]
+        run = min(runs,key=lambda r: r["import_ms"])
+        problems = []
+        if run["returncode"] != 0:
+            problems.append(f"exit code {run['returncode']}")
+        if run["import_ms"] > args.budget_ms:
+            problems.append(f"over budget ({args.budget_ms:.0f}ms)")
+        if run["heavy"]:
+            problems.append(f"imports {', '.join(run['heavy'])}")
+        if run["data_files"]:
+            problems.append(f"opens {', '.join(run['data_files'])}")
+        failures += bool(problems)
+        status = "FAIL " + "; ".join(problems) if problems else "ok"
+        print(f"{run['import_ms']:7.1f}ms  {' '.join(argv):60}  {status}")
+
+    if failures:
+        print(f"{failures} of {len(COLD_START_PATHS)} cold start paths failed")
+        sys.exit(1)
+    print(f"all {len(COLD_START_PATHS)} cold start paths within budget")
+
+if __name__ == "__main__":
+    main()
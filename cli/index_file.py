@@ -0,0 +1,176 @@
+import bisect
+import json
+import mmap
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from collections.abc import Mapping
+
+# Single-file index layout (little endian):
+#   fixed header | section table | header crc32 | 8-byte aligned sections
+# Every section is a flat NumPy array, so opening the file only parses the
+# header and wraps the mapped pages; nothing is read until it is touched.
+INDEX_MAGIC = b"RAGSIDX\0"
+INDEX_VERSION = 3
+
+HEADER = struct.Struct("<8sII QQQQ dd QQ II d")
+SECTION = struct.Struct("<16s8sQQ")
+CRC = struct.Struct("<I")
+ALIGN = 8
+
+class IndexFormatError(Exception):
+    pass
+
+def source_fingerprint(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return 0,0
+    return stat.st_size,stat.st_mtime_ns
+
+def _padding(offset):
+    return -offset % ALIGN
+
+def write_index_file(path,meta,sections):
+    sections = {name: np.ascontiguousarray(array) for name,array in sections.items()}
+    table_size = HEADER.size + SECTION.size*len(sections) + CRC.size
+    offset = table_size + _padding(table_size)
+    payload_start = offset
+
+    entries = []
+    for name,array in sections.items():
+        entries.append((name,array,offset))
+        offset += array.nbytes
+        offset += _padding(offset)
+
+    payload_crc = 0
+    for name,array,start in entries:
+        payload_crc = zlib.crc32(memoryview(array).cast("B"),payload_crc)
+
+    header = HEADER.pack(INDEX_MAGIC,INDEX_VERSION,len(sections),
+                         meta["n_docs"],meta["n_terms"],meta["n_postings"],meta["total_length"],
+                         meta["k1"],meta["b"],
+                         meta["source_size"],meta["source_mtime_ns"],
+                         payload_crc,meta["impact_bits"],meta["impact_scale"])
+    table = b"".join(SECTION.pack(name.encode(),array.dtype.str.encode(),start,len(array))
+                     for name,array,start in entries)
+    header += table
+    header += CRC.pack(zlib.crc32(header))
+
+    # write next to the target and swap it in, so processes that still map
+    # the previous file keep reading a consistent index
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path,"wb") as f:
+        f.write(header)
+        f.write(b"\0"*(payload_start-len(header)))
+        for name,array,start in entries:
+            f.write(memoryview(array).cast("B"))
+            f.write(b"\0"*_padding(f.tell()))
+    os.replace(tmp_path,path)
+
+def open_index_file(path):
+    with open(path,"rb") as f:
+        buf = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+
+    if len(buf) < HEADER.size or buf[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+        raise IndexFormatError(f"{path} is not an index file")
+    fields = HEADER.unpack_from(buf,0)
+    (magic,version,n_sections,n_docs,n_terms,n_postings,total_length,
+     k1,b,source_size,source_mtime_ns,payload_crc,impact_bits,impact_scale) = fields
+    if version != INDEX_VERSION:
+        raise IndexFormatError(f"{path} has format version {version}, expected {INDEX_VERSION}")
+
+    table_end = HEADER.size + SECTION.size*n_sections
+    if len(buf) < table_end + CRC.size:
+        raise IndexFormatError(f"{path} is truncated")
+    (header_crc,) = CRC.unpack_from(buf,table_end)
+    if zlib.crc32(buf[:table_end]) != header_crc:
+        raise IndexFormatError(f"{path} has a corrupt header")
+
+    sections = {}
+    payload_start = len(buf)
+    for i in range(n_sections):
+        name,dtype,start,count = SECTION.unpack_from(buf,HEADER.size + SECTION.size*i)
+        dtype = np.dtype(dtype.rstrip(b"\0").decode())
+        if start + dtype.itemsize*count > len(buf):
+            raise IndexFormatError(f"{path} is truncated")
+        sections[name.rstrip(b"\0").decode()] = np.frombuffer(buf,dtype=dtype,count=count,offset=start)
+        payload_start = min(payload_start,start)
+
+    meta = {"n_docs": n_docs, "n_terms": n_terms, "n_postings": n_postings, "total_length": total_length,
+            "k1": k1, "b": b, "source_size": source_size, "source_mtime_ns": source_mtime_ns,
+            "impact_bits": impact_bits, "impact_scale": impact_scale,
+            "payload_crc": payload_crc, "payload_start": payload_start}
+    return meta,sections,buf
+
+def verify_index_file(meta,sections):
+    crc = 0
+    for array in sections.values():
+        crc = zlib.crc32(memoryview(array).cast("B"),crc)
+    if crc != meta["payload_crc"]:
+        raise IndexFormatError("Index payload checksum mismatch")
+
+def pack_strings(strings):
+    encoded = [s.encode() for s in strings]
+    offsets = np.zeros(len(encoded)+1,dtype=np.int64)
+    np.cumsum([len(s) for s in encoded],out=offsets[1:])
+    return offsets,np.frombuffer(b"".join(encoded),dtype=np.uint8)
+
+class Vocabulary():
+    # sorted terms stored as utf-8 bytes; utf-8 byte order equals code point
+    # order, so lookups are a binary search over the mapped strings
+    def __init__(self,offsets,data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets)-1
+
+    def term(self,term_id):
+        return self.data[self.offsets[term_id]:self.offsets[term_id+1]].tobytes().decode()
+
+    def get(self,term,default=None):
+        key = term.encode()
+        term_id = bisect.bisect_left(range(len(self)),key,key=lambda i: self.data[self.offsets[i]:self.offsets[i+1]].tobytes())
+        if term_id < len(self) and self.data[self.offsets[term_id]:self.offsets[term_id+1]].tobytes() == key:
+            return term_id
+        return default
+
+    def __contains__(self,term):
+        return self.get(term) is not None
+
+    def __iter__(self):
+        return (self.term(i) for i in range(len(self)))
+
+class DocumentStore(Mapping):
+    # documents are JSON blobs keyed by external id; only the ones asked for
+    # are decoded
+    def __init__(self,doc_ids,doc_id_order,offsets,data):
+        self.doc_ids = doc_ids
+        self.doc_id_order = doc_id_order
+        self.offsets = offsets
+        self.data = data
+
+    def __internal(self,doc_id):
+        pos = np.searchsorted(self.doc_ids,doc_id,sorter=self.doc_id_order)
+        if pos >= len(self.doc_ids) or self.doc_ids[self.doc_id_order[pos]] != doc_id:
+            return None
+        return self.doc_id_order[pos]
+
+    def __getitem__(self,doc_id):
+        internal = self.__internal(doc_id)
+        if internal is None:
+            raise KeyError(doc_id)
+        return json.loads(self.data[self.offsets[internal]:self.offsets[internal+1]].tobytes())
+
+    def __contains__(self,doc_id):
+        return self.__internal(doc_id) is not None
+
+    def __iter__(self):
+        return iter(self.doc_ids.tolist())
+
+    def __len__(self):
+        return len(self.doc_ids)
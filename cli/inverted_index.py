@@ -1,103 +1,291 @@
+import json
 import math
+import mmap
 import os
-import pickle
 import string
+import tempfile
 
-from collections import Counter, defaultdict
+import numpy as np
+
+from array import array
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import batched, repeat
 from constants import *
-from preprocessing import preprocess
+from corpus import iter_movies
+from index_file import *
+from preprocessing import get_tokenizer, preprocess
 
 class InvertedIndex():
     def __init__(self):
-        self.index = defaultdict(set)
         self.docmap = {}
-        self.term_frequencies = defaultdict(Counter)
-        self.doc_lengths = {}
-        self.index_path = "cache/index.pkl"
-        
-    def __add_document(self, doc_id, text,stopwords=None):
-        tokens = preprocess(text,stopwords)
-        
-        if doc_id not in self.term_frequencies:
-            self.term_frequencies[doc_id] = Counter()
-
-        if doc_id not in self.doc_lengths:
-            self.doc_lengths[doc_id] = 0
-        self.doc_lengths[doc_id] = len(tokens)
-
-        for token in tokens:
-            if token not in self.index:
-                self.index[token] = set()
-            self.index[token].add(doc_id)
-
-            self.term_frequencies[doc_id][token] += 1
+        self.index_path = "cache/index.bin"
+        self.source_path = "data/movies.json"
+        self.__clear()
 
-    def __get_avg_doc_length(self) -> float:
-        if len(self.doc_lengths) == 0:
-            return 0.0
-        
-        total = 0
-        for doc in self.doc_lengths:
-            total += self.doc_lengths[doc]
+    def __clear(self):
+        # terms and documents map to dense ids; postings of term t are
+        # postings_docs/postings_tfs[postings_offsets[t]:postings_offsets[t+1]]
+        self.vocab = {}
+        self.doc_ids = np.zeros(0,dtype=np.int64)
+        self.doc_id_order = np.zeros(0,dtype=np.int64)
+        self.doc_lengths = np.zeros(0,dtype=np.int32)
+        self.postings_offsets = np.zeros(1,dtype=np.int64)
+        self.postings_docs = np.zeros(0,dtype=np.int32)
+        self.postings_tfs = np.zeros(0,dtype=np.int32)
+        self.term_max_scores = np.zeros(0,dtype=np.float64)
+        self.block_offsets = np.zeros(1,dtype=np.int64)
+        self.block_max_scores = np.zeros(0,dtype=np.float64)
+        self.block_last_docs = np.zeros(0,dtype=np.int32)
+        self.impact_bits = 0
+        self.impact_scale = 0.0
+        self.impacts = None
+        self.bm25_params = (BM25_K1,BM25_B)
+        self.source_fingerprint = (0,0)
+        self.meta = None
+        self.__prepare_stats(0)
+
+    def __prepare_stats(self,total_length):
+        # N and avgdl only change on build/load, so the search path computes
+        # them once instead of per doc and term
+        self.total_docs = len(self.doc_ids)
+        self.total_length = total_length
+        self.avg_doc_length = total_length/self.total_docs if self.total_docs else 0.0
+
+    def __term_idf(self,term_id):
+        doc_freq = self.__doc_freq(term_id)
+        return math.log((self.total_docs-doc_freq+0.5)/(doc_freq+0.5)+1)
 
-        return total/len(self.doc_lengths)
+    def __internal_doc(self,doc_id):
+        pos = np.searchsorted(self.doc_ids,doc_id,sorter=self.doc_id_order)
+        if pos < self.total_docs and self.doc_ids[self.doc_id_order[pos]] == doc_id:
+            return int(self.doc_id_order[pos])
+        return None
+
+    def __postings(self,term_id):
+        start,end = self.postings_offsets[term_id],self.postings_offsets[term_id+1]
+        return self.postings_docs[start:end],self.postings_tfs[start:end]
+
+    def __get_avg_doc_length(self) -> float:
+        return self.avg_doc_length
 
     def get_documents(self, term):
         term = term.lower()
-        docs = self.index.get(term,set())
-        return sorted(list(docs))
+        term_id = self.vocab.get(term)
+        if term_id is None:
+            return []
+        docs,_ = self.__postings(term_id)
+        return sorted(self.doc_ids[docs].tolist())
 
-    def build(self,stopwords=None):
-        import json
-        with open("data/movies.json","r") as f:
-            data = json.load(f)
-        movies = data["movies"]
-        for movie in movies:
-            doc_id = movie["id"]
-            self.docmap[doc_id] = movie
+    def build(self,documents=None,stopwords=None,impact_bits=None,workers=1):
+        if documents is None:
+            documents = iter_movies(self.source_path)
 
-            combined = f"{movie['title']} {movie['description']}"
-            self.__add_document(doc_id,combined,stopwords)
+        # documents are serialized to an anonymous spill file as they stream
+        # past, so the corpus is never held in memory as Python objects
+        doc_ids = array("q")
+        blob_sizes = array("q",[0])
+        spill = tempfile.TemporaryFile()
 
-    def save(self):
-        os.makedirs("cache", exist_ok=True)
+        def texts():
+            for movie in documents:
+                doc_ids.append(movie["id"])
+                blob_sizes.append(spill.write(json.dumps(movie).encode()))
+                yield f"{movie['title']} {movie['description']}"
 
-        with open("cache/index.pkl", "wb") as f:
-            pickle.dump(self.index,f)
+        # documents are indexed in contiguous shards, in this process or a
+        # pool; partials come back in shard order so the merged index is the
+        # same as a serial build
+        with spill:
+            if workers > 1:
+                shards = batched(texts(),INDEX_SHARD_SIZE)
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    self.__merge_shards(windowed_map(pool,index_shard,shards,workers*2,stopwords),doc_ids,impact_bits)
+            else:
+                shards = batched(texts(),TOKENIZE_BATCH_SIZE)
+                self.__merge_shards(map(index_shard,shards,repeat(stopwords)),doc_ids,impact_bits)
+            self.docmap = spilled_documents(spill,self.doc_ids,self.doc_id_order,blob_sizes)
+        self.source_fingerprint = source_fingerprint(self.source_path)
 
-        with open("cache/docmap.pkl", "wb") as f:
-            pickle.dump(self.docmap,f)
+    def __merge_shards(self,partials,doc_ids,impact_bits):
+        vocab = {}
+        term_ids,docs,tfs,doc_lengths = [],[],[],[]
+        offset = 0
+        for shard_terms,shard_term_ids,shard_docs,shard_tfs,shard_lengths in partials:
+            lookup = np.array([vocab.setdefault(term,len(vocab)) for term in shard_terms],dtype=np.int32)
+            term_ids.append(lookup[shard_term_ids])
+            docs.append(shard_docs+offset)
+            tfs.append(shard_tfs)
+            doc_lengths.append(shard_lengths)
+            offset += len(shard_lengths)
 
-        with open("cache/term_frequencies.pkl", "wb") as f:
-            pickle.dump(self.term_frequencies,f)
+        empty = [np.zeros(0,dtype=np.int32)]
+        self.assemble(list(vocab),np.concatenate(term_ids or empty),np.concatenate(docs or empty),
+                      np.concatenate(tfs or empty),np.frombuffer(doc_ids,dtype=np.int64),
+                      np.concatenate(doc_lengths or empty),None,impact_bits)
 
-        with open("cache/doc_lengths.pkl", "wb") as f:
-            pickle.dump(self.doc_lengths,f)
+    def assemble(self,terms,term_ids,docs,tfs,doc_ids,doc_lengths,docmap,impact_bits=None):
+        # turns flat (term id, internal doc, tf) triples into the CSR layout;
+        # term_ids index into terms, docs into doc_ids/doc_lengths. Final term
+        # ids follow sorted term order so the saved vocabulary can be binary
+        # searched without a rebuild of the mapping
+        if impact_bits is not None and impact_bits not in BM25_IMPACT_BITS:
+            raise ValueError(f"impact_bits must be one of {BM25_IMPACT_BITS}")
+        order = sorted(range(len(terms)),key=terms.__getitem__)
+        remap = np.zeros(len(terms),dtype=np.int32)
+        remap[order] = np.arange(len(terms),dtype=np.int32)
+        term_ids = remap[term_ids]
+        postings_order = np.argsort(term_ids,kind="stable")
 
-    def load(self):
-        try:
-            with open("cache/index.pkl", "rb") as f:
-                self.index = pickle.load(f)
+        self.docmap = docmap
+        self.vocab = {terms[old]: term_id for term_id,old in enumerate(order)}
+        self.doc_ids = np.array(doc_ids,dtype=np.int64)
+        self.doc_id_order = np.argsort(self.doc_ids,kind="stable")
+        self.doc_lengths = np.array(doc_lengths,dtype=np.int32)
+        self.postings_offsets = np.zeros(len(terms)+1,dtype=np.int64)
+        np.cumsum(np.bincount(term_ids,minlength=len(terms)),out=self.postings_offsets[1:])
+        self.postings_docs = np.asarray(docs,dtype=np.int32)[postings_order]
+        self.postings_tfs = np.asarray(tfs,dtype=np.int32)[postings_order]
+        self.source_fingerprint = (0,0)
+        self.meta = None
+        self.bm25_params = (BM25_K1,BM25_B)
+        self.__prepare_stats(int(self.doc_lengths.sum()))
+        tf_scores = bm25_tf_component(self.postings_tfs,self.doc_lengths[self.postings_docs],self.avg_doc_length,BM25_K1,BM25_B)
+        self.__build_score_bounds(tf_scores)
+        self.__build_impacts(tf_scores,impact_bits)
+
+    def __build_impacts(self,tf_scores,impact_bits):
+        # full BM25 score of every posting, quantized to impact_bits so a
+        # query is an integer gather-and-add; score ~= impact * impact_scale
+        self.impact_bits = impact_bits or 0
+        self.impact_scale = 0.0
+        self.impacts = None
+        if not impact_bits:
+            return
+
+        dtype = np.uint8 if impact_bits == 8 else np.uint16
+        doc_freqs = np.diff(self.postings_offsets)
+        idf = np.log((self.total_docs-doc_freqs+0.5)/(doc_freqs+0.5)+1)
+        postings_scores = tf_scores * np.repeat(idf,doc_freqs)
+        top = float(postings_scores.max()) if len(postings_scores) else 0.0
+        self.impact_scale = top/np.iinfo(dtype).max if top > 0 else 1.0
+        # every posting keeps at least impact 1 so matches are never dropped
+        self.impacts = np.clip(np.rint(postings_scores/self.impact_scale),1,np.iinfo(dtype).max).astype(dtype)
+
+    def __build_score_bounds(self,tf_scores,block_size=BM25_BLOCK_SIZE):
+        # upper bounds of the BM25 tf component (idf is applied at query
+        # time) per term and per block of block_size postings, used by the
+        # maxscore/blockmax modes to skip documents that cannot reach the top-k
+        n_terms = len(self.postings_offsets)-1
+        if len(self.postings_docs) == 0:
+            self.term_max_scores = np.zeros(n_terms,dtype=np.float64)
+            self.block_offsets = np.zeros(n_terms+1,dtype=np.int64)
+            self.block_max_scores = np.zeros(0,dtype=np.float64)
+            self.block_last_docs = np.zeros(0,dtype=np.int32)
+            return
+
+        self.term_max_scores = np.maximum.reduceat(tf_scores,self.postings_offsets[:-1])
 
-            with open("cache/docmap.pkl", "rb") as f:
-                self.docmap = pickle.load(f)
-            
-            with open("cache/term_frequencies.pkl","rb") as f:
-                self.term_frequencies = pickle.load(f)
+        doc_freqs = np.diff(self.postings_offsets)
+        block_counts = (doc_freqs+block_size-1)//block_size
+        self.block_offsets = np.zeros(n_terms+1,dtype=np.int64)
+        np.cumsum(block_counts,out=self.block_offsets[1:])
+        block_rank = np.arange(self.block_offsets[-1]) - np.repeat(self.block_offsets[:-1],block_counts)
+        block_starts = np.repeat(self.postings_offsets[:-1],block_counts) + block_rank*block_size
+        block_ends = np.append(block_starts[1:],len(self.postings_docs))
+        self.block_max_scores = np.maximum.reduceat(tf_scores,block_starts)
+        self.block_last_docs = self.postings_docs[block_ends-1]
 
-            with open("cache/doc_lengths.pkl", "rb") as f:
-                self.doc_lengths = pickle.load(f)
+    def save(self):
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+
+        vocab_offsets,vocab_data = pack_strings(self.terms())
+        if isinstance(self.docmap,DocumentStore):
+            doc_offsets,doc_data = self.docmap.offsets,self.docmap.data
+        else:
+            doc_offsets,doc_data = pack_strings(json.dumps(self.docmap[doc_id]) for doc_id in self.doc_ids.tolist())
+        meta = {"n_docs": self.total_docs, "n_terms": len(self.vocab), "n_postings": len(self.postings_docs),
+                "total_length": self.total_length, "k1": self.bm25_params[0], "b": self.bm25_params[1],
+                "source_size": self.source_fingerprint[0], "source_mtime_ns": self.source_fingerprint[1],
+                "impact_bits": self.impact_bits, "impact_scale": self.impact_scale}
+        sections = {
+            "vocab_offsets": vocab_offsets,
+            "vocab_data": vocab_data,
+            "postings_offsets": self.postings_offsets,
+            "postings_docs": self.postings_docs,
+            "postings_tfs": self.postings_tfs,
+            "doc_ids": self.doc_ids,
+            "doc_id_order": self.doc_id_order,
+            "doc_lengths": self.doc_lengths,
+            "term_max_scores": self.term_max_scores,
+            "block_offsets": self.block_offsets,
+            "block_max_scores": self.block_max_scores,
+            "block_last_docs": self.block_last_docs,
+            "doc_offsets": doc_offsets,
+            "doc_data": doc_data,
+        }
+        if self.impacts is not None:
+            sections["impacts"] = self.impacts
+        write_index_file(self.index_path,meta,sections)
 
+    def load(self,verify=False):
+        try:
+            meta,sections,self.mmap = open_index_file(self.index_path)
         except FileNotFoundError:
             raise FileNotFoundError("Index files not found. Run build first.")
+        if verify:
+            verify_index_file(meta,sections)
+
+        self.meta = meta
+        self.vocab = Vocabulary(sections["vocab_offsets"],sections["vocab_data"])
+        self.postings_offsets = sections["postings_offsets"]
+        self.postings_docs = sections["postings_docs"]
+        self.postings_tfs = sections["postings_tfs"]
+        self.doc_ids = sections["doc_ids"]
+        self.doc_id_order = sections["doc_id_order"]
+        self.doc_lengths = sections["doc_lengths"]
+        self.term_max_scores = sections["term_max_scores"]
+        self.block_offsets = sections["block_offsets"]
+        self.block_max_scores = sections["block_max_scores"]
+        self.block_last_docs = sections["block_last_docs"]
+        self.docmap = DocumentStore(self.doc_ids,self.doc_id_order,sections["doc_offsets"],sections["doc_data"])
+        self.impact_bits = meta["impact_bits"]
+        self.impact_scale = meta["impact_scale"]
+        self.impacts = sections.get("impacts")
+        self.bm25_params = (meta["k1"],meta["b"])
+        self.source_fingerprint = (meta["source_size"],meta["source_mtime_ns"])
+        self.__prepare_stats(meta["total_length"])
+
+    def is_stale(self,impact_bits=None):
+        # score bounds and impacts bake in k1/b, so a change of the BM25
+        # constants also needs a rebuild
+        if self.bm25_params != (BM25_K1,BM25_B):
+            return True
+        if impact_bits and self.impact_bits != impact_bits:
+            return True
+        return self.source_fingerprint != source_fingerprint(self.source_path)
+
+    def terms(self):
+        if isinstance(self.vocab,Vocabulary):
+            return iter(self.vocab)
+        return sorted(self.vocab,key=self.vocab.get)
 
     def get_tf(self, doc_id, term):
         tokens = preprocess(term)
         if len(tokens) != 1:
             raise ValueError("get_tf expects only one token")
         token = tokens[0]
-        
-        return self.term_frequencies.get(doc_id, {}).get(token,0)
+
+        term_id = self.vocab.get(token)
+        internal = self.__internal_doc(doc_id)
+        if term_id is None or internal is None:
+            return 0
+
+        docs,tfs = self.__postings(term_id)
+        pos = np.searchsorted(docs,internal)
+        if pos < len(docs) and docs[pos] == internal:
+            return int(tfs[pos])
+        return 0
 
     def get_bm25_idf(self,term:str)->float:
         tokens = preprocess(term)
@@ -105,19 +293,22 @@ class InvertedIndex():
             raise ValueError("Expected single token")
         token = tokens[0]
 
-        totaldocs = len(self.docmap)
-        totalmatch = len(self.index[token])
-    
-        idf = math.log((totaldocs-totalmatch+0.5)/(totalmatch + 0.5)+1)
-        return idf
+        term_id = self.vocab.get(token)
+        if term_id is None:
+            return math.log((self.total_docs+0.5)/0.5+1)
+        return self.__term_idf(term_id)
 
     def bm25_idf_command(self,term):
 
         self.load()
         return self.get_bm25_idf(term)
-    
+
     def get_bm25_tf(self,doc_id,term,k1=BM25_K1,b=BM25_B):
-        length_norm = 1 - b + b * (self.doc_lengths[doc_id] / self.__get_avg_doc_length())
+        internal = self.__internal_doc(doc_id)
+        if internal is None:
+            raise KeyError(f"Document {doc_id} not in index")
+        doc_length = self.doc_lengths[internal]
+        length_norm = 1 - b + b * (doc_length / self.__get_avg_doc_length())
         tf = self.get_tf(doc_id,term)
         return ((tf*(k1+1))/(tf+k1*length_norm))
 
@@ -130,15 +321,282 @@ class InvertedIndex():
         idf = self.get_bm25_idf(term)
         return tf*idf
 
-    def bm25_search(self,query,limit):
-        tokens = preprocess(query)
-        scores = {}
-        for doc in self.docmap:
-            total = 0
-            for token in tokens:
-                total += self.bm25(doc,token)
+    def score_tokens(self,tokens,k1=BM25_K1,b=BM25_B):
+        scores = np.zeros(self.total_docs,dtype=np.float64)
+        if self.avg_doc_length == 0:
+            return scores
+
+        # term-at-a-time: only the postings of the query terms are touched
+        for token,count in Counter(tokens).items():
+            term_id = self.vocab.get(token)
+            if term_id is None:
+                continue
+            docs,tfs = self.__postings(term_id)
+            scores[docs] += count * self.__term_idf(term_id) * bm25_tf_component(tfs,self.doc_lengths[docs],self.avg_doc_length,k1,b)
+        return scores
+
+    def term_postings(self,token):
+        term_id = self.vocab.get(token)
+        if term_id is None:
+            return None
+        return self.__postings(term_id)
+
+    def __doc_freq(self,term_id):
+        return int(self.postings_offsets[term_id+1]-self.postings_offsets[term_id])
+
+    def __lookup(self,term_id,positions):
+        # tf of term_id in each of the (sorted) doc positions, 0 when absent
+        docs,tfs = self.__postings(term_id)
+        found = np.searchsorted(docs,positions)
+        hit = found < len(docs)
+        hit[hit] = docs[found[hit]] == positions[hit]
+        return np.where(hit,tfs[np.minimum(found,len(docs)-1)],0)
+
+    def __block_bounds(self,term_id,weight,positions):
+        blocks = slice(self.block_offsets[term_id],self.block_offsets[term_id+1])
+        block_last_docs = self.block_last_docs[blocks]
+        found = np.searchsorted(block_last_docs,positions)
+        inside = found < len(block_last_docs)
+        return np.where(inside,weight*self.block_max_scores[blocks][np.minimum(found,len(block_last_docs)-1)],0.0)
+
+    def pruned_top_k(self,tokens,limit,block_max=True,k1=BM25_K1,b=BM25_B):
+        # MaxScore: terms are visited by descending upper bound. Once the
+        # bounds of the terms left cannot lift an unseen document over the
+        # current k-th score, only documents already seen stay candidates and
+        # the remaining postings are probed for them instead of walked. With
+        # block_max the candidates are also checked against the maxima of
+        # the blocks that would hold them.
+        if limit <= 0 or self.avg_doc_length == 0:
+            return []
+
+        terms = []
+        for token,count in Counter(tokens).items():
+            term_id = self.vocab.get(token)
+            if term_id is not None:
+                terms.append((term_id,count*self.__term_idf(term_id)))
+        if not terms:
+            return []
+
+        by_bound = sorted(terms,key=lambda t: t[1]*self.term_max_scores[t[0]],reverse=True)
+        remaining = np.cumsum([weight*self.term_max_scores[term_id] for term_id,weight in by_bound][::-1])[::-1]
+        remaining = np.append(remaining,0.0)
+        # keeps pruning conservative against summation order rounding
+        slack = 1 - 1e-9
+
+        scores = np.zeros(self.total_docs,dtype=np.float64)
+        threshold = 0.0
+        i = 0
+        while i < len(by_bound) and remaining[i] >= threshold*slack:
+            term_id,weight = by_bound[i]
+            docs,tfs = self.__postings(term_id)
+            scores[docs] += weight * bm25_tf_component(tfs,self.doc_lengths[docs],self.avg_doc_length,k1,b)
+            # the k-th score within any subset of the partial scores is a
+            # lower bound for the final k-th score
+            threshold = max(threshold,kth_score(scores[docs],limit))
+            i += 1
+        candidates = np.flatnonzero(scores)
+        # probing a postings list costs about log(df) per candidate, so
+        # lists that are short next to the candidate set are walked instead
+        left_postings = sum(self.__doc_freq(t) for t,_ in by_bound[i:])
+        block_max = block_max and len(candidates)*PROBE_RATIO < left_postings
+        if block_max:
+            # per candidate suffix sums of the block maxima of the terms left
+            block_bounds = np.array([self.__block_bounds(t,w,candidates) for t,w in by_bound[i:]])
+            block_bounds = np.cumsum(block_bounds[::-1],axis=0)[::-1]
+
+        for j in range(i,len(by_bound)):
+            term_id,weight = by_bound[j]
+            if block_max:
+                alive = scores[candidates] + block_bounds[j-i] >= threshold*slack
+                block_bounds = block_bounds[:,alive]
+            else:
+                alive = scores[candidates] + remaining[j] >= threshold*slack
+            candidates = candidates[alive]
+
+            if len(candidates)*PROBE_RATIO < self.__doc_freq(term_id):
+                tfs = self.__lookup(term_id,candidates)
+                hit = tfs > 0
+                positions = candidates[hit]
+                scores[positions] += weight * bm25_tf_component(tfs[hit],self.doc_lengths[positions],self.avg_doc_length,k1,b)
+            else:
+                # pruned documents may pick up partial scores here, but only
+                # candidate scores are read from now on
+                docs,tfs = self.__postings(term_id)
+                scores[docs] += weight * bm25_tf_component(tfs,self.doc_lengths[docs],self.avg_doc_length,k1,b)
+            threshold = max(threshold,kth_score(scores[candidates],limit))
+
+        candidates = candidates[scores[candidates] >= threshold*slack]
+        # rescore the survivors in query term order so the scores match the
+        # exhaustive path bit for bit
+        exact = np.zeros(len(candidates),dtype=np.float64)
+        for term_id,weight in terms:
+            tfs = self.__lookup(term_id,candidates)
+            hit = tfs > 0
+            exact[hit] += weight * bm25_tf_component(tfs[hit],self.doc_lengths[candidates[hit]],self.avg_doc_length,k1,b)
+        return [(int(candidates[pos]),float(exact[pos])) for pos in top_k_positions(exact,limit)]
+
+    def score_impacts(self,tokens):
+        if self.impacts is None:
+            raise ValueError("Index has no impact scores. Build it with impact_bits set.")
+
+        scores = np.zeros(self.total_docs,dtype=np.int64)
+        for token,count in Counter(tokens).items():
+            term_id = self.vocab.get(token)
+            if term_id is None:
+                continue
+            start,end = self.postings_offsets[term_id],self.postings_offsets[term_id+1]
+            scores[self.postings_docs[start:end]] += count*self.impacts[start:end].astype(np.int64)
+        return scores
+
+    def score_token_batch(self,token_lists,k1=BM25_K1,b=BM25_B):
+        # score_tokens for several queries, one row each; the BM25 weights of
+        # a term are computed once however many of the queries contain it
+        scores = np.zeros((len(token_lists),self.total_docs),dtype=np.float64)
+        if self.avg_doc_length == 0:
+            return scores
+
+        weights = {}
+        for row,tokens in zip(scores,token_lists):
+            for token,count in Counter(tokens).items():
+                if token not in weights:
+                    term_id = self.vocab.get(token)
+                    weights[token] = None if term_id is None else self.__term_weights(term_id,k1,b)
+                if weights[token] is None:
+                    continue
+                docs,idf,tf_component = weights[token]
+                row[docs] += count * idf * tf_component
+        return scores
+
+    def __term_weights(self,term_id,k1,b):
+        docs,tfs = self.__postings(term_id)
+        return docs,self.__term_idf(term_id),bm25_tf_component(tfs,self.doc_lengths[docs],self.avg_doc_length,k1,b)
+
+    def bm25_search(self,query,limit,mode="exhaustive"):
+        return self.bm25_search_tokens(preprocess(query),limit,mode)
+
+    def bm25_search_batch(self,queries,limit,mode="exhaustive"):
+        # bm25_search for many queries. Exhaustive scoring shares term weights
+        # across blocks of BM25_QUERY_BATCH_SIZE queries; the pruned and
+        # impact modes rank each query on its own
+        token_lists = get_tokenizer().preprocess_many(queries)
+        if mode != "exhaustive":
+            return [self.bm25_search_tokens(tokens,limit,mode) for tokens in token_lists]
+
+        results = []
+        for start in range(0,len(token_lists),BM25_QUERY_BATCH_SIZE):
+            for scores in self.score_token_batch(token_lists[start:start+BM25_QUERY_BATCH_SIZE]):
+                top = top_k_positions(scores,limit)
+                results.append([(int(self.doc_ids[pos]),float(scores[pos])) for pos in top])
+        return results
+
+    def bm25_search_tokens(self,tokens,limit,mode="exhaustive"):
+        # an index built without impact scores serves impact mode exhaustively
+        if mode == "impact" and self.impacts is None:
+            mode = "exhaustive"
+        if mode == "exhaustive":
+            scores = self.score_tokens(tokens)
+            top = top_k_positions(scores,limit)
+            return [(int(self.doc_ids[pos]),float(scores[pos])) for pos in top]
+        if mode == "impact":
+            scores = self.score_impacts(tokens)
+            top = top_k_positions(scores,limit)
+            return [(int(self.doc_ids[pos]),float(scores[pos]*self.impact_scale)) for pos in top]
+        if mode not in BM25_MODES:
+            raise ValueError(f"Unknown BM25 search mode '{mode}', expected one of {BM25_MODES}")
+
+        # pruning cannot skip much when the query terms cover a large share
+        # of the documents (BM25_PRUNED_FALLBACK_COVERAGE) and limit is not
+        # small next to their postings (BM25_PRUNED_FALLBACK_LIMIT_RATIO);
+        # the bookkeeping then costs more than scoring exhaustively
+        postings = sum(self.__doc_freq(term_id) for term_id in {self.vocab.get(token) for token in tokens} if term_id is not None)
+        if postings >= BM25_PRUNED_FALLBACK_COVERAGE*self.total_docs and limit >= BM25_PRUNED_FALLBACK_LIMIT_RATIO*postings:
+            return self.bm25_search_tokens(tokens,limit,"exhaustive")
+        ranked = self.pruned_top_k(tokens,limit,block_max=(mode == "blockmax"))
+        # pad with non-matching documents in index order, as the
+        # exhaustive ranking does when fewer than limit documents match
+        matched = {pos for pos,_ in ranked}
+        pos = 0
+        while len(ranked) < limit and pos < self.total_docs:
+            if pos not in matched:
+                ranked.append((pos,0.0))
+            pos += 1
+        return [(int(self.doc_ids[pos]),score) for pos,score in ranked]
+
+
+BM25_MODES = ("exhaustive","maxscore","blockmax","impact")
+
+def load_or_build_index(impact_bits=None):
+    # the saved index, rebuilt first when it is missing, unreadable or older
+    # than the corpus and constants it was built from. A rebuilt file is
+    # mapped again and checked against its payload checksum
+    index = InvertedIndex()
+    try:
+        index.load()
+        rebuild = index.is_stale(impact_bits)
+    except (FileNotFoundError,IndexFormatError):
+        rebuild = True
+    if rebuild:
+        index.build(impact_bits=impact_bits)
+        index.save()
+        index.load(verify=True)
+    return index
+
+def spilled_documents(spill,doc_ids,doc_id_order,blob_sizes):
+    # the mapping outlives the closed spill file, so the blobs stay readable
+    spill.flush()
+    size = spill.tell()
+    data = np.frombuffer(mmap.mmap(spill.fileno(),size,access=mmap.ACCESS_READ),dtype=np.uint8) if size else np.zeros(0,dtype=np.uint8)
+    offsets = np.cumsum(np.frombuffer(blob_sizes,dtype=np.int64))
+    return DocumentStore(doc_ids,doc_id_order,offsets,data)
+
+def windowed_map(pool,function,items,window,*args):
+    # pool.map, in order, with at most window items submitted and not yet
+    # consumed, so a streamed input is only read as fast as it is indexed
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(function,item,*args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def index_shard(texts,stopwords=None):
+    # partial index of one shard: its own vocabulary in first-seen order and
+    # flat (term, doc, tf) triples with doc ids local to the shard
+    vocab = {}
+    doc_lengths = array("i")
+    term_ids = array("i")
+    docs = array("i")
+    tfs = array("i")
+    for doc,tokens in enumerate(get_tokenizer(stopwords).preprocess_many(texts)):
+        doc_lengths.append(len(tokens))
+        for token,tf in Counter(tokens).items():
+            term_ids.append(vocab.setdefault(token,len(vocab)))
+            docs.append(doc)
+            tfs.append(tf)
+    return (list(vocab),np.frombuffer(term_ids,dtype=np.int32),np.frombuffer(docs,dtype=np.int32),
+            np.frombuffer(tfs,dtype=np.int32),np.frombuffer(doc_lengths,dtype=np.int32))
+
+def bm25_tf_component(tf,doc_length,avg_doc_length,k1,b):
+    length_norm = 1 - b + b * (doc_length / avg_doc_length)
+    return (tf*(k1+1))/(tf+k1*length_norm)
+
+def kth_score(scores,limit):
+    if len(scores) < limit:
+        return 0.0
+    return float(np.partition(scores,len(scores)-limit)[len(scores)-limit])
 
-            scores[doc] = total
+def top_k_positions(scores,limit):
+    # partial selection of the k best positions; ties keep document order,
+    # matching a stable sort over the full score list
+    if limit <= 0 or len(scores) == 0:
+        return []
+    if limit >= len(scores):
+        return np.argsort(-scores,kind="stable").tolist()
 
-        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-        return ranked[:limit]
+    kth = np.partition(scores,len(scores)-limit)[len(scores)-limit]
+    above = np.flatnonzero(scores > kth)
+    ties = np.flatnonzero(scores == kth)[:limit-len(above)]
+    top = np.concatenate([above,ties])
+    order = np.lexsort((top,-scores[top]))
+    return top[order].tolist()
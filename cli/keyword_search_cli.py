@@ -7,7 +7,11 @@ import os
 import string
 
 from constants import *
-from inverted_index import InvertedIndex
+from corpus import iter_movies
+from index_file import IndexFormatError
+from inverted_index import BM25_MODES, InvertedIndex
+from lib.search_client import SearchClient, server_url
+from segmented_index import SegmentedIndex
 from preprocessing import preprocess
 
 def matching_logic(query,data,stopwords):
@@ -28,6 +32,11 @@ def matching_logic(query,data,stopwords):
                 return True
     return False
 
+def read_stopwords():
+    stopwords_path = os.path.join(os.path.dirname(__file__),"..","data","stopwords.txt")
+    with open(stopwords_path) as f:
+        return f.read().splitlines()
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Keyword Search CLI")
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
@@ -35,6 +44,16 @@ def main() -> None:
     search_parser = subparsers.add_parser("search", help="Search movies using BM25")
     search_parser.add_argument("query", type=str, help="Search query")
     build_parser = subparsers.add_parser("build", help="Build inverted index")
+    build_parser.add_argument("--impact-bits", type=int, choices=BM25_IMPACT_BITS, help="Also store BM25 scores per posting quantized to this many bits")
+    build_parser.add_argument("--segments", action="store_true", help="Build a segmented index that supports incremental updates")
+    build_parser.add_argument("--workers", type=int, default=1, help="Number of processes used to tokenize and index")
+    verify_parser = subparsers.add_parser("verify", help="Check the saved index against its payload checksum")
+    verify_parser.add_argument("--segments", action="store_true", help="Check every segment of the segmented index")
+    add_parser = subparsers.add_parser("add", help="Add or update movies in the segmented index")
+    add_parser.add_argument("path", type=str, help="JSON file with a list of movies or a {\"movies\": [...]} object, or JSON lines")
+    delete_parser = subparsers.add_parser("delete", help="Delete movies from the segmented index")
+    delete_parser.add_argument("doc_ids", type=int, nargs="+", help="Document IDs to delete")
+    merge_parser = subparsers.add_parser("merge", help="Merge segments of the segmented index")
     tf_parser = subparsers.add_parser("tf", help="Get frequency of token in document")
     tf_parser.add_argument("doc_id",type=int,help="Document ID")
     tf_parser.add_argument("term", type=str,help="Term to check frequency for")
@@ -54,16 +73,13 @@ def main() -> None:
     bm25search_parser = subparsers.add_parser("bm25search", help="Search movies using full BM25 scoring")
     bm25search_parser.add_argument("query", type=str, help="Search query")   
     bm25search_parser.add_argument("--limit", type=int, default=5,help="optional limit character")
+    bm25search_parser.add_argument("--segments", action="store_true", help="Search the segmented index")
+    bm25search_parser.add_argument("--mode", type=str, choices=BM25_MODES, default="exhaustive", help="Score every matching document or prune with per-term/per-block score bounds")
+    bm25search_parser.add_argument("--server", type=str, default=None, help=f"Search through a running search server (default: ${SEARCH_SERVER_ENV})")
 
     args = parser.parse_args()
     path = os.path.join(os.path.dirname(__file__),"..","data","movies.json")
-    stopwords_path = os.path.join(os.path.dirname(__file__),"..","data","stopwords.txt")
-    with open(path) as f:
-        data = json.load(f)
 
-    with open(stopwords_path) as f:
-        stopwords = f.read().splitlines()
-        
     match args.command:
         case "search":
             print(f"Searching for: {args.query}")
@@ -75,8 +91,13 @@ def main() -> None:
             except FileNotFoundError:
                 print("index not found. run build first.")
                 return
+            except IndexFormatError as e:
+                print(f"{e}. run build again.")
+                return
+            if index.is_stale():
+                print("warning: index is older than data/movies.json or BM25 constants. run build to refresh it.")
 
-            tokens = preprocess(args.query,stopwords)
+            tokens = preprocess(args.query,read_stopwords())
 
             results = []
             seen = set()
@@ -98,11 +119,74 @@ def main() -> None:
                 print(f"{i}. {movie['title']} (ID: {movie['id']})")
         
         case "build":
-            index = InvertedIndex()
-            index.build(data["movies"],stopwords)
-            index.save()
+            stopwords = read_stopwords()
+            if args.segments:
+                index = SegmentedIndex()
+                index.build(iter_movies(path),stopwords)
+            else:
+                index = InvertedIndex()
+                index.build(iter_movies(path),stopwords,args.impact_bits,args.workers)
+                index.save()
+                index.load(verify=True)
             print("index built")
 
+        case "verify":
+            if args.segments:
+                segmented = SegmentedIndex()
+                try:
+                    segmented.load()
+                except FileNotFoundError:
+                    print("segmented index not found. run build --segments first.")
+                    return
+                paths = [s.index.index_path for s in segmented.segments]
+            else:
+                paths = [InvertedIndex().index_path]
+
+            for index_path in paths:
+                index = InvertedIndex()
+                index.index_path = index_path
+                try:
+                    index.load(verify=True)
+                except FileNotFoundError:
+                    print("index not found. run build first.")
+                    return
+                except IndexFormatError as e:
+                    print(f"{index_path}: {e}. run build again.")
+                    return
+                print(f"{index_path}: ok ({index.total_docs} documents)")
+
+        case "add":
+            movies = list(iter_movies(args.path))
+
+            index = SegmentedIndex()
+            try:
+                index.load()
+            except FileNotFoundError:
+                print("segmented index not found. run build --segments first.")
+                return
+            index.add_documents(movies,read_stopwords(),background_merge=False)
+            print(f"added {len(movies)} movies, {len(index.segments)} segments")
+
+        case "delete":
+            index = SegmentedIndex()
+            try:
+                index.load()
+            except FileNotFoundError:
+                print("segmented index not found. run build --segments first.")
+                return
+            index.delete_documents(args.doc_ids,background_merge=False)
+            print(f"deleted {len(args.doc_ids)} movies, {len(index.segments)} segments")
+
+        case "merge":
+            index = SegmentedIndex()
+            try:
+                index.load()
+            except FileNotFoundError:
+                print("segmented index not found. run build --segments first.")
+                return
+            index.merge({s.name for s in index.segments})
+            print(f"{len(index.segments)} segments")
+
         case "tf":
             index = InvertedIndex()
             try:
@@ -147,7 +231,7 @@ def main() -> None:
             totalmatch = len(index.get_documents(token))
 
             idf = math.log((totaldocs+1)/(totalmatch+1))
-            tf = index.term_frequencies[args.doc_id][args.term]
+            tf = index.get_tf(args.doc_id,args.term)
             tfidf = tf * idf
 
             print(f"TF-IDF score of '{args.term}' in document '{args.doc_id}': {tfidf:.2f}")
@@ -165,15 +249,27 @@ def main() -> None:
         case "bm25search":
             print(f"Searching for: {args.query}")
 
-            index = InvertedIndex()
+            url = server_url(args.server)
+            if url:
+                results = SearchClient(url).call("bm25search",query=args.query,limit=args.limit,mode=args.mode,segments=args.segments)
+                for i,result in enumerate(results,start=1):
+                    print(f"{i}. ({result['id']}) {result['title']} - Score: {result['score']:.2f}")
+                return
+
+            index = SegmentedIndex() if args.segments else InvertedIndex()
 
             try:
                 index.load()
             except FileNotFoundError:
                 print("index not found. run build first.")
                 return
+            except IndexFormatError as e:
+                print(f"{e}. run build again.")
+                return
+            if index.is_stale():
+                print("warning: index is older than data/movies.json or BM25 constants. run build to refresh it.")
 
-            results = index.bm25_search(args.query,args.limit)
+            results = index.bm25_search(args.query,args.limit,args.mode)
 
             for i,(doc,score) in enumerate(results,start=1):
                 title = index.docmap[doc]["title"]
@@ -0,0 +1,138 @@
+import os
+import time
+import zlib
+
+import numpy as np
+
+from constants import *
+from lib.semantic_search import normalize_embeddings, similarity_scores, top_k
+
+class IVFIndex():
+    # inverted file over unit vectors: a spherical k-means coarse quantizer
+    # splits the vectors into lists and a query only scans the lists of its
+    # nprobe closest centroids. Members are stored grouped by list, so the
+    # vectors of list l are list_members[list_offsets[l]:list_offsets[l+1]]
+    def __init__(self,path="cache/chunk_ivf.npz"):
+        self.path = path
+        self.centroids = np.zeros((0,0),dtype=np.float32)
+        self.list_offsets = np.zeros(1,dtype=np.int64)
+        self.list_members = np.zeros(0,dtype=np.int64)
+        self.fingerprint = np.zeros(3,dtype=np.int64)
+
+    def build(self,embeddings,n_lists=None,iterations=ANN_KMEANS_ITERATIONS,seed=0):
+        # the fingerprint covers the vectors as passed in, which is what
+        # is_stale is later given
+        self.fingerprint = embeddings_fingerprint(embeddings)
+        embeddings = normalize_embeddings(embeddings)
+        if len(embeddings) == 0:
+            raise ValueError("Cannot build an ANN index without embeddings")
+        if n_lists is None:
+            n_lists = int(ANN_LISTS_PER_SQRT*np.sqrt(len(embeddings)))
+        n_lists = max(1,min(n_lists,len(embeddings)))
+        rng = np.random.default_rng(seed)
+
+        # centroids are trained on a sample; every vector is assigned after
+        sample_size = min(len(embeddings),n_lists*ANN_TRAIN_PER_LIST)
+        sample = embeddings[rng.choice(len(embeddings),sample_size,replace=False)]
+        centroids = kmeans(sample,n_lists,iterations,rng)
+
+        assignment = nearest_centroids(centroids,embeddings)
+        self.centroids = centroids
+        self.list_members = np.argsort(assignment,kind="stable")
+        self.list_offsets = np.zeros(n_lists+1,dtype=np.int64)
+        np.cumsum(np.bincount(assignment,minlength=n_lists),out=self.list_offsets[1:])
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path),exist_ok=True)
+        np.savez(self.path,centroids=self.centroids,list_offsets=self.list_offsets,
+                 list_members=self.list_members,fingerprint=self.fingerprint)
+
+    def load(self):
+        try:
+            data = np.load(self.path)
+        except FileNotFoundError:
+            raise FileNotFoundError("ANN index not found. Run build_ann first.")
+        self.centroids = data["centroids"]
+        self.list_offsets = data["list_offsets"]
+        self.list_members = data["list_members"]
+        self.fingerprint = data["fingerprint"]
+
+    def is_stale(self,embeddings):
+        return not np.array_equal(self.fingerprint,embeddings_fingerprint(embeddings))
+
+    def candidates(self,query,nprobe=ANN_NPROBE):
+        nprobe = max(1,min(nprobe,len(self.centroids)))
+        lists,_ = top_k(similarity_scores(self.centroids,query),nprobe)
+        return np.concatenate([self.list_members[self.list_offsets[l]:self.list_offsets[l+1]] for l in lists.tolist()])
+
+    def search(self,embeddings,query,limit,nprobe=ANN_NPROBE):
+        members = self.candidates(query,nprobe)
+        top,scores = top_k(similarity_scores(embeddings[members],query),limit)
+        return members[top],scores
+
+def kmeans(sample,n_clusters,iterations,rng,spherical=True):
+    # Lloyd iterations; spherical k-means keeps unit centroids and assigns
+    # by dot product, the euclidean variant is what product quantization uses
+    centroids = sample[rng.choice(len(sample),n_clusters,replace=False)]
+    for _ in range(iterations):
+        assignment = nearest_centroids(centroids,sample,spherical)
+        counts = np.bincount(assignment,minlength=n_clusters)
+        order = np.argsort(assignment,kind="stable")
+        filled = np.flatnonzero(counts)
+        sums = np.zeros_like(centroids)
+        sums[filled] = np.add.reduceat(sample[order],(np.cumsum(counts)-counts)[filled])
+        # empty clusters restart from random sample points
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = sample[rng.choice(len(sample),len(empty))]
+        counts[empty] = 1
+        centroids = normalize_embeddings(sums) if spherical else (sums/counts[:,None]).astype(sample.dtype)
+    return centroids
+
+def nearest_centroids(centroids,embeddings,spherical=True,batch_size=ANN_ASSIGN_BATCH_SIZE):
+    # argmin |x-c|^2 is argmax x.c - |c|^2/2, so both variants are one product
+    bias = 0 if spherical else -0.5*np.einsum("ij,ij->i",centroids,centroids)
+    assignment = np.empty(len(embeddings),dtype=np.int64)
+    for start in range(0,len(embeddings),batch_size):
+        batch = embeddings[start:start+batch_size]
+        assignment[start:start+batch_size] = np.argmax(batch @ centroids.T + bias,axis=1)
+    return assignment
+
+def embeddings_fingerprint(embeddings):
+    embeddings = np.ascontiguousarray(embeddings,dtype=np.float32)
+    return np.array([embeddings.shape[0],embeddings.shape[1] if embeddings.ndim == 2 else 0,
+                     zlib.crc32(memoryview(embeddings).cast("B"))],dtype=np.int64)
+
+def measure_recall(index,embeddings,queries,limit=10,nprobe=ANN_NPROBE):
+    # recall@limit of the ANN search against exact brute force, plus the
+    # mean latency of each, in seconds per query
+    hits = 0
+    exact_time = ann_time = 0.0
+    for query in queries:
+        start = time.perf_counter()
+        exact,_ = top_k(similarity_scores(embeddings,query),limit)
+        exact_time += time.perf_counter()-start
+
+        start = time.perf_counter()
+        found,_ = index.search(embeddings,query,limit,nprobe)
+        ann_time += time.perf_counter()-start
+        hits += len(np.intersect1d(exact,found))
+    total = max(1,len(queries))
+    return hits/max(1,total*min(limit,len(embeddings))),exact_time/total,ann_time/total
+
+def ann_recall_command(nprobes,n_queries=200,limit=10,seed=0):
+    # held-out style check: stored chunk vectors, lightly perturbed, serve
+    # as queries so no model has to be loaded
+    embeddings = np.load("cache/chunk_embeddings.npy")
+    index = IVFIndex()
+    index.load()
+    if index.is_stale(embeddings):
+        print("warning: ANN index is older than the chunk embeddings. run build_ann to refresh it.")
+    embeddings = normalize_embeddings(embeddings)
+
+    rng = np.random.default_rng(seed)
+    picked = embeddings[rng.choice(len(embeddings),min(n_queries,len(embeddings)),replace=False)]
+    queries = normalize_embeddings(picked + rng.normal(scale=0.05,size=picked.shape).astype(np.float32))
+    print(f"{len(embeddings)} chunks in {len(index.centroids)} lists, {len(queries)} queries, recall@{limit}")
+    for nprobe in nprobes:
+        recall,exact_time,ann_time = measure_recall(index,embeddings,queries,limit,nprobe)
+        print(f"nprobe {nprobe:4d}: recall {recall:.4f}  exact {exact_time*1000:.3f} ms  ann {ann_time*1000:.3f} ms")
@@ -1,83 +1,217 @@
-import json
+import hashlib
 import os
 import numpy as np
 
+from array import array
 from constants import *
 from lib.semantic_search import *
+from lib.ann_index import IVFIndex
+from index_file import source_fingerprint
 
 class ChunkedSemanticSearch(SemanticSearch):
-    def __init__(self, model_name = "all-MiniLM-L6-v2") -> None:
-        super().__init__(model_name)
+    def __init__(self, model_name = "all-MiniLM-L6-v2", storage="float32", rescore=True, query_cache_path=None, model=None) -> None:
+        super().__init__(model_name,storage,rescore,query_cache_path,model)
         self.chunk_embeddings = None
+        self.chunk_quantized = None
         self.chunk_metadata = None
+        self.ann_index = None
 
     def build_chunk_embeddings(self,documents):
-        self.documents = documents
-        self.document_map = {}
+        # movies stream through once and are chunked on the fly; the cache
+        # encodes only chunks whose text it has not embedded before. When
+        # neither the descriptions nor the embedding cache changed since the
+        # last run, the stored chunk metadata is used and nothing is chunked
+        cache = EmbeddingCache("cache/chunk_embeddings.npy",self.model_name)
+        source = documents_digest(documents) if isinstance(documents,list) else None
+        embeddings = self.__load_stored_chunks(cache,source)
+        if embeddings is not None:
+            self.chunk_embeddings,self.chunk_quantized = self.open_storage("cache/chunk_embeddings.npy",embeddings)
+            return self.chunk_embeddings
+
+        movie_idx,chunk_idx,total_chunks = array("i"),array("i"),array("i")
+
+        def chunk_texts():
+            for idx,movie in enumerate(documents):
+                if movie["description"] == "":
+                    continue
+                chunks = semantic_chunk(movie["description"],4,1)
+
+                for position,chunk in enumerate(chunks):
+                    movie_idx.append(idx)
+                    chunk_idx.append(position)
+                    total_chunks.append(len(chunks))
+                    yield chunk
+
+        embeddings = cache.refresh(chunk_texts(),self.encode_normalized,self.model.get_sentence_embedding_dimension())
+        self.embedding_stats = cache.stats
+        self.chunk_metadata = {"movie_idx": np.frombuffer(movie_idx,dtype=np.int32),
+                               "chunk_idx": np.frombuffer(chunk_idx,dtype=np.int32),
+                               "total_chunks": np.frombuffer(total_chunks,dtype=np.int32)}
+        self.__prepare_chunks()
+        if source is not None:
+            np.savez("cache/chunk_metadata.npz",source=source,
+                     keys=np.array(source_fingerprint(cache.keys_path),dtype=np.int64),**self.chunk_metadata)
+        self.chunk_embeddings,self.chunk_quantized = self.open_storage("cache/chunk_embeddings.npy",embeddings)
 
-        for movie in self.documents:
-            self.document_map[movie["id"]] = movie
- 
-        all_chunks = []
-        metadata = []
-       
-        for movie_idx,movie in enumerate(self.documents):
-            if movie["description"] == "":
-                continue
-            chunks = semantic_chunk(movie["description"],4,1)
-            
-            for chunk_idx,chunk in enumerate(chunks):
-                all_chunks.append(chunk)
-                metadata.append({"movie_idx":movie_idx,"chunk_idx":chunk_idx,"total_chunks":len(chunks)})
-    
-        self.chunk_embeddings = self.model.encode(all_chunks,show_progress_bar=True)
-        self.chunk_metadata=metadata
-        np.save("cache/chunk_embeddings.npy",self.chunk_embeddings)
-        with open("cache/chunk_metadata.json","w") as f:
-            json.dump({"chunks": self.chunk_metadata, "total_chunks": len(all_chunks)}, f, indent=2)
-        
         return self.chunk_embeddings
 
+    def __load_stored_chunks(self,cache,source):
+        # the stored metadata is only trusted for the descriptions it was
+        # chunked from and the embedding keys file it was saved next to
+        if source is None:
+            return None
+        try:
+            stored = np.load("cache/chunk_metadata.npz")
+            keys,embeddings = cache.load()
+        except (FileNotFoundError,KeyError,ValueError):
+            return None
+        if not all(name in stored for name in ("source","keys","movie_idx","chunk_idx","total_chunks")):
+            return None
+        if (not np.array_equal(stored["source"],source) or len(stored["movie_idx"]) != len(keys)
+                or not np.array_equal(stored["keys"],source_fingerprint(cache.keys_path))):
+            return None
+        self.chunk_metadata = {name: stored[name] for name in ("movie_idx","chunk_idx","total_chunks")}
+        self.__prepare_chunks()
+        self.embedding_stats = {"reused": len(keys), "encoded": 0, "dropped": 0}
+        return embeddings
+
     def load_or_create_chunk_embeddings(self,documents: list[dict]) -> np.ndarray:
-        self.documents = documents
+        self.documents = list(documents)
         self.document_map = {}
 
         for movie in self.documents:
             self.document_map[movie["id"]] = movie
+        self.movie_ids = np.fromiter((movie["id"] for movie in self.documents),dtype=np.int64,count=len(self.documents))
+        return self.build_chunk_embeddings(self.documents)
 
-        if os.path.exists("cache/chunk_embeddings.npy") and os.path.exists("cache/chunk_metadata.json"):
-            self.chunk_embeddings = np.load("cache/chunk_embeddings.npy")
-            with open("cache/chunk_metadata.json","r") as f:
-                data = json.load(f)
-                self.chunk_metadata = data["chunks"]
-            return self.chunk_embeddings
+    def __prepare_chunks(self):
+        # chunks are laid out contiguously per movie, in movie order: movie
+        # slot s owns chunk rows chunk_offsets[s]:chunk_offsets[s+1]
+        movie_idx = self.chunk_metadata["movie_idx"]
+        starts = np.flatnonzero(np.diff(movie_idx,prepend=-1))
+        self.chunk_movies = movie_idx[starts]
+        self.chunk_offsets = np.append(starts,len(movie_idx))
+        self.chunk_slots = np.repeat(np.arange(len(starts)),np.diff(self.chunk_offsets))
 
-        return self.build_chunk_embeddings(documents)
+    def __movie_rows(self,slots):
+        # chunk rows of the given movie slots, in row order
+        slots = np.sort(slots)
+        starts = self.chunk_offsets[slots]
+        counts = self.chunk_offsets[slots+1]-starts
+        return np.arange(counts.sum()) + np.repeat(starts-np.cumsum(counts)+counts,counts)
 
-    def search_chunks(self,query: str, limit:int=10):
-        embed_query = self.generate_embedding(query)
-        chunk_scores = []
+    def load_or_create_ann_index(self,n_lists=None,rebuild=False):
+        # the IVF index lives next to the chunk embeddings and is rebuilt
+        # whenever they no longer match the vectors it was trained on. It is
+        # fingerprinted against the stored file, whatever the storage mode
+        stored = np.load("cache/chunk_embeddings.npy",mmap_mode="r")
+        index = IVFIndex()
+        if not rebuild:
+            try:
+                index.load()
+                rebuild = index.is_stale(stored)
+            except FileNotFoundError:
+                rebuild = True
+        if rebuild:
+            index.build(stored,n_lists)
+            index.save()
+        self.ann_index = index
+        return index
 
-        for idx,chunk in enumerate(self.chunk_embeddings):
-            similarity = cosine_similarity(chunk,embed_query)
-            metadata = self.chunk_metadata[idx]
-            chunk_scores.append({"chunk_idx": metadata["chunk_idx"],"movie_idx": metadata["movie_idx"],"score":similarity})
+    def __chunk_scores(self,query,chunks=None):
+        if self.chunk_quantized is not None:
+            return self.chunk_quantized.scores(query,chunks)
+        return similarity_scores(self.chunk_embeddings if chunks is None else self.chunk_embeddings[chunks],query)
 
-        scores = {}
-        for chunk_score in chunk_scores:
-            movie_idx = chunk_score["movie_idx"]
-            score = chunk_score["score"]
-            if movie_idx not in scores or score > scores[movie_idx]:
-                scores[movie_idx] = score
+    def __movie_scores(self,chunks,chunk_scores):
+        # best chunk per movie as one segment reduction; a subset of chunks
+        # is put in row order first so each movie is again one run
+        movie_scores = np.full(len(self.chunk_movies),-np.inf,dtype=np.float32)
+        if len(chunk_scores) == 0:
+            return movie_scores
+        if chunks is None:
+            movie_scores[:] = np.maximum.reduceat(chunk_scores,self.chunk_offsets[:-1])
+            return movie_scores
+        order = np.argsort(chunks,kind="stable")
+        slots = self.chunk_slots[chunks[order]]
+        starts = np.flatnonzero(np.diff(slots,prepend=-1))
+        movie_scores[slots[starts]] = np.maximum.reduceat(chunk_scores[order],starts)
+        return movie_scores
 
-        sorted_movies = sorted(scores.items(),key=lambda x: x[1], reverse=True)
-        top = sorted_movies[:limit]
+    def rank_movies(self,query,limit=10,nprobe=None):
+        # positions in documents and scores of the best movies, best first.
+        # nprobe switches to the ANN index: only chunks in the nprobe closest
+        # lists are scored, and movies without such a chunk are left out
+        return self.rank_embedding(self.generate_embedding(query),limit,nprobe)
+
+    def rank_movies_batch(self,queries,limit=10,nprobe=None):
+        # rank_movies for many queries: one encoding call, and without ANN
+        # probing each block of queries is scored with one matrix product
+        embeddings = self.generate_embeddings(queries)
+        if nprobe is not None and self.ann_index is not None:
+            # every query probes its own lists, so candidates differ per query
+            return [self.rank_embedding(embed_query,limit,nprobe) for embed_query in embeddings]
+
+        ranked = []
+        for start in range(0,len(embeddings),QUERY_BATCH_SIZE):
+            block = embeddings[start:start+QUERY_BATCH_SIZE]
+            if self.chunk_quantized is not None:
+                chunk_scores = self.chunk_quantized.score_matrix(block)
+            else:
+                chunk_scores = similarity_matrix(self.chunk_embeddings,block)
+            if len(self.chunk_movies):
+                movie_scores = np.maximum.reduceat(chunk_scores,self.chunk_offsets[:-1],axis=1)
+            else:
+                movie_scores = np.zeros((len(block),0),dtype=np.float32)
+            ranked.extend(self.__top_movies(embed_query,scores,None,limit) for embed_query,scores in zip(block,movie_scores))
+        return ranked
+
+    def rank_embedding(self,embed_query,limit=10,nprobe=None):
+        # rank_movies for a query that is already encoded
+        chunks = None
+        if nprobe is not None and self.ann_index is not None:
+            chunks = self.ann_index.candidates(embed_query,nprobe)
+        movie_scores = self.__movie_scores(chunks,self.__chunk_scores(embed_query,chunks))
+        return self.__top_movies(embed_query,movie_scores,chunks,limit)
+
+    def __top_movies(self,embed_query,movie_scores,chunks,limit):
+        if self.chunk_quantized is not None and self.rescore:
+            # the best movies on compressed codes are rescored exactly over
+            # all of their (candidate) chunks
+            candidates,scores = top_k(movie_scores,limit*EMBEDDING_RESCORE_FACTOR)
+            candidates = candidates[scores > -np.inf]
+            rescored = self.__movie_rows(candidates)
+            if chunks is not None:
+                rescored = np.intersect1d(rescored,chunks)
+            rescored,exact = self.chunk_quantized.exact_scores(embed_query,rescored)
+            movie_scores = self.__movie_scores(rescored,exact)
+
+        top,scores = top_k(movie_scores,limit)
+        found = scores > -np.inf
+        return self.chunk_movies[top[found]],scores[found]
+
+    def search_chunks(self,query: str, limit:int=10, nprobe=None):
+        return self.__chunk_results(*self.rank_movies(query,limit,nprobe))
+
+    def search_chunks_batch(self,queries,limit=10,nprobe=None):
+        return [self.__chunk_results(movies,scores) for movies,scores in self.rank_movies_batch(queries,limit,nprobe)]
+
+    def __chunk_results(self,movies,scores):
         results = []
-        for movie_idx,score in top:
-            movie = self.documents[movie_idx]
+        for idx,score in zip(movies.tolist(),scores.tolist()):
+            movie = self.documents[idx]
             results.append({"id":movie["id"],
                            "title":movie["title"],
                            "document": movie["description"][:100],
                            "score": round(score,SCORE_PRECISION),
                            "metadata": movie.get("metadata",{})})
         return results
+
+def documents_digest(documents):
+    # what the chunk layout depends on: the position and description of
+    # every movie, and the chunking parameters
+    digest = hashlib.sha1(b"4,1")
+    for movie in documents:
+        digest.update(movie["description"].encode())
+        digest.update(b"\0")
+    return np.frombuffer(digest.digest(),dtype=np.uint8)
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from array import array
+from constants import *
+
+class EmbeddingCache():
+    # an embedding matrix saved with the content hash of every row, the hash
+    # covering the model name and the embedded text. refresh() lines the rows
+    # up with a new list of texts: cached vectors are reused wherever the hash
+    # matches and only new or edited texts go through the model
+    def __init__(self,path,model_name):
+        self.path = path
+        self.model_name = model_name
+        base = os.path.splitext(path)[0]
+        self.keys_path = f"{base}.keys.npy"
+        self.manifest_path = f"{base}.manifest.json"
+        self.stats = {"reused": 0, "encoded": 0, "dropped": 0}
+        self.changed = False
+
+    def key(self,text):
+        return hashlib.sha1(f"{self.model_name}\0{text}".encode()).hexdigest().encode()
+
+    def load(self):
+        with open(self.manifest_path,"r") as f:
+            manifest = json.load(f)
+        keys = np.load(self.keys_path)
+        embeddings = np.load(self.path,mmap_mode="r")
+        if manifest["model"] != self.model_name or len(keys) != len(embeddings) or manifest["rows"] != len(keys):
+            raise FileNotFoundError(f"{self.manifest_path} does not describe {self.path}")
+        return keys,embeddings
+
+    def refresh(self,texts,encode,dimensions,batch_size=EMBED_BATCH_SIZE):
+        # encode takes a list of texts and returns their (normalized) vectors;
+        # texts may be a stream and are only kept while waiting for a batch
+        try:
+            old_keys,old = self.load()
+        except (FileNotFoundError,KeyError,ValueError):
+            old_keys,old = np.zeros(0,dtype="S40"),np.zeros((0,dimensions),dtype=np.float32)
+        lookup = {key: row for row,key in enumerate(old_keys.tolist())}
+
+        # sources[i] >= 0 is a row of the old matrix, -1-j the j-th new vector
+        keys = []
+        sources = array("q")
+        fresh = {}
+        pending = []
+        blocks = []
+        for text in texts:
+            key = self.key(text)
+            keys.append(key)
+            if key in lookup:
+                sources.append(lookup[key])
+                continue
+            if key not in fresh:
+                fresh[key] = len(fresh)
+                pending.append(text)
+                if len(pending) >= batch_size:
+                    blocks.append(encode(pending))
+                    pending = []
+            sources.append(-1-fresh[key])
+        if pending:
+            blocks.append(encode(pending))
+
+        sources = np.frombuffer(sources,dtype=np.int64)
+        hit = sources >= 0
+        self.stats = {"reused": int(hit.sum()), "encoded": len(fresh),
+                      "dropped": len(old) - len(np.unique(sources[hit]))}
+        self.changed = not (len(sources) == len(old) and np.array_equal(sources,np.arange(len(old))))
+        if not self.changed:
+            return old
+
+        embeddings = np.empty((len(sources),dimensions),dtype=np.float32)
+        embeddings[hit] = old[sources[hit]]
+        if blocks:
+            embeddings[~hit] = np.concatenate(blocks)[-1-sources[~hit]]
+        self.save(np.array(keys,dtype="S40"),embeddings)
+        return embeddings
+
+    def save(self,keys,embeddings):
+        # the manifest goes last, so a crash in between leaves a cache that
+        # fails to load and is rebuilt rather than one with mismatched rows
+        os.makedirs(os.path.dirname(self.path) or ".",exist_ok=True)
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+        save_array(self.path,embeddings)
+        save_array(self.keys_path,keys)
+        manifest = {"model": self.model_name, "dimensions": int(embeddings.shape[1]), "rows": len(keys),
+                    "embeddings": os.path.basename(self.path), "keys": os.path.basename(self.keys_path)}
+        with open(self.manifest_path,"w") as f:
+            json.dump(manifest,f)
+
+def save_array(path,array):
+    # replaced rather than rewritten in place, so readers that still map the
+    # old file keep a consistent copy
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path,"wb") as f:
+        np.save(f,array)
+    os.replace(tmp_path,path)
@@ -0,0 +1,109 @@
+import math
+import resource
+import sys
+import time
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+QUALITY_METRICS = ("precision","recall","f1","mrr","ndcg")
+LATENCY_STAGES = ("bm25","embed","semantic","fusion","total")
+LATENCY_PERCENTILES = (50,95,99)
+
+def precision_recall_f1(retrieved,relevant,limit):
+    relevant_retrieved = sum(1 for title in retrieved[:limit] if title in relevant)
+    precision = relevant_retrieved/limit
+    recall = relevant_retrieved/len(relevant) if relevant else 0.0
+    if precision == 0 and recall == 0:
+        return precision,recall,0.0
+    return precision,recall,2*(precision*recall)/(precision+recall)
+
+def reciprocal_rank(retrieved,relevant):
+    for rank,title in enumerate(retrieved,1):
+        if title in relevant:
+            return 1/rank
+    return 0.0
+
+def ndcg(retrieved,relevant,limit):
+    # binary relevance: a relevant title at rank r adds 1/log2(r+1)
+    dcg = sum(1/math.log2(rank+1) for rank,title in enumerate(retrieved[:limit],1) if title in relevant)
+    ideal = sum(1/math.log2(rank+1) for rank in range(1,min(len(relevant),limit)+1))
+    return dcg/ideal if ideal else 0.0
+
+def score_case(case,retrieved,limit):
+    relevant = set(case["relevant_docs"])
+    precision,recall,f1 = precision_recall_f1(retrieved,relevant,limit)
+    return {"query": case["query"], "precision": precision, "recall": recall, "f1": f1,
+            "mrr": reciprocal_rank(retrieved[:limit],relevant), "ndcg": ndcg(retrieved,relevant,limit),
+            "retrieved": retrieved, "relevant": case["relevant_docs"]}
+
+def latency_summary(values):
+    values = np.asarray(values,dtype=np.float64)
+    if len(values) == 0:
+        return {}
+    summary = {f"p{p}": float(v) for p,v in zip(LATENCY_PERCENTILES,np.percentile(values,LATENCY_PERCENTILES))}
+    summary["mean"] = float(values.mean())
+    summary["max"] = float(values.max())
+    return summary
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/(1024*1024) if sys.platform == "darwin" else peak/1024
+
+def run_queries(search,queries,workers=1):
+    # search(query, timings) for every query on a pool of workers; returns
+    # the results and per-stage milliseconds in query order, and the wall
+    # time of the whole run in seconds
+    def run(query):
+        timings = {}
+        start = time.perf_counter()
+        results = search(query,timings)
+        timings["total"] = (time.perf_counter()-start)*1000
+        return results,timings
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max(1,workers)) as pool:
+        runs = list(pool.map(run,queries))
+    return runs,time.perf_counter()-start
+
+def evaluate(search,cases,limit,workers=1,repeat=1):
+    # quality is scored on the first pass over cases; latency covers every
+    # query of every pass
+    queries = [case["query"] for case in cases]
+    passes = [run_queries(search,queries,workers) for _ in range(max(1,repeat))]
+    per_query = [score_case(case,[r["document"]["title"] for r in results],limit)
+                 for case,(results,_) in zip(cases,passes[0][0])]
+    for scores,(_,timings) in zip(per_query,passes[0][0]):
+        scores["latency_ms"] = timings
+
+    stages = {}
+    for runs,_ in passes:
+        for _,timings in runs:
+            for stage,ms in timings.items():
+                stages.setdefault(stage,[]).append(ms)
+    elapsed = sum(seconds for _,seconds in passes)
+    return {"queries": len(cases),
+            "quality": {metric: float(np.mean([q[metric] for q in per_query])) if per_query else 0.0
+                        for metric in QUALITY_METRICS},
+            "latency_ms": {stage: latency_summary(stages[stage]) for stage in LATENCY_STAGES if stage in stages},
+            "qps": len(queries)*len(passes)/elapsed if elapsed else 0.0,
+            "elapsed_s": elapsed,
+            "peak_rss_mb": peak_rss_mb(),
+            "per_query": per_query}
+
+def compare_reports(baseline,current):
+    # (name, baseline value, current value) for the summary numbers of two
+    # reports; names missing from either report are skipped
+    def flatten(report):
+        values = {f"quality.{metric}": value for metric,value in report.get("quality",{}).items()}
+        for stage,summary in report.get("latency_ms",{}).items():
+            values.update({f"latency_ms.{stage}.{name}": value for name,value in summary.items()})
+        for name in ("qps","peak_rss_mb"):
+            if name in report:
+                values[name] = report[name]
+        return values
+
+    old,new = flatten(baseline),flatten(current)
+    return [(name,old[name],new[name]) for name in new if name in old]
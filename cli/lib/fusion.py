@@ -0,0 +1,90 @@
+import numpy as np
+
+from lib.semantic_search import top_k
+
+FUSION_NORMALIZATIONS = ("minmax","zscore")
+
+def min_max(scores):
+    scores = np.asarray(scores,dtype=np.float64)
+    if len(scores) == 0:
+        return scores
+    low,high = scores.min(),scores.max()
+    if high == low:
+        return np.ones_like(scores)
+    return (scores-low)/(high-low)
+
+def z_score(scores):
+    scores = np.asarray(scores,dtype=np.float64)
+    if len(scores) == 0:
+        return scores
+    std = scores.std()
+    if std == 0:
+        return np.zeros_like(scores)
+    return (scores-scores.mean())/std
+
+NORMALIZERS = {"minmax": min_max, "zscore": z_score}
+
+def ranked_arrays(ranked):
+    # [(doc_id, score), ...] as an id array and a score array
+    ids = np.fromiter((doc_id for doc_id,_ in ranked),dtype=np.int64,count=len(ranked))
+    scores = np.fromiter((score for _,score in ranked),dtype=np.float64,count=len(ranked))
+    return ids,scores
+
+def merge_candidates(bm25_ids,semantic_ids):
+    # union of both candidate lists: BM25 hits in rank order, then semantic
+    # hits BM25 missed in theirs. Returns the union and where each semantic
+    # hit sits in it
+    bm25_ids = np.asarray(bm25_ids,dtype=np.int64)
+    semantic_ids = np.asarray(semantic_ids,dtype=np.int64)
+    ids = np.concatenate([bm25_ids,semantic_ids[~np.isin(semantic_ids,bm25_ids)]])
+    order = np.argsort(ids,kind="stable")
+    positions = order[np.searchsorted(ids,semantic_ids,sorter=order)]
+    return ids,positions
+
+class FusionEngine():
+    # fuses a BM25 and a semantic candidate list held as arrays. Only the
+    # final top-k are looked up in documents, a mapping of id to document
+    def __init__(self,documents):
+        self.documents = documents
+
+    def rrf(self,bm25_ids,semantic_ids,k=60,limit=10):
+        ids,positions = merge_candidates(bm25_ids,semantic_ids)
+        bm25_ranks = np.zeros(len(ids),dtype=np.int64)
+        bm25_ranks[:len(bm25_ids)] = np.arange(1,len(bm25_ids)+1)
+        semantic_ranks = np.zeros(len(ids),dtype=np.int64)
+        semantic_ranks[positions] = np.arange(1,len(positions)+1)
+
+        scores = np.zeros(len(ids))
+        scores[:len(bm25_ids)] += 1/(k+bm25_ranks[:len(bm25_ids)])
+        scores[positions] += 1/(k+semantic_ranks[positions])
+
+        top,fused = top_k(scores,limit)
+        return [{"document": self.documents[doc_id],
+                 "bm25_rank": bm25_rank or None,
+                 "semantic_rank": semantic_rank or None,
+                 "rrf": score}
+                for doc_id,bm25_rank,semantic_rank,score in zip(ids[top].tolist(),bm25_ranks[top].tolist(),
+                                                                 semantic_ranks[top].tolist(),fused.tolist())]
+
+    def weighted(self,bm25_ids,bm25_scores,semantic_ids,semantic_scores,alpha=0.5,limit=5,normalization="minmax"):
+        if normalization not in NORMALIZERS:
+            raise ValueError(f"Unknown normalization '{normalization}', expected one of {FUSION_NORMALIZATIONS}")
+        normalize = NORMALIZERS[normalization]
+        ids,positions = merge_candidates(bm25_ids,semantic_ids)
+        bm25_norm = normalize(bm25_scores)
+        semantic_norm = normalize(semantic_scores)
+
+        # a candidate missing from one list gets that list's floor: 0 after
+        # min-max scaling, the lowest z-score otherwise
+        bm25 = np.full(len(ids),min(0.0,bm25_norm.min(initial=0.0)))
+        bm25[:len(bm25_norm)] = bm25_norm
+        semantic = np.full(len(ids),min(0.0,semantic_norm.min(initial=0.0)))
+        semantic[positions] = semantic_norm
+
+        top,fused = top_k(alpha*bm25 + (1-alpha)*semantic,limit)
+        return [{"document": self.documents[doc_id],
+                 "bm25": bm25_score,
+                 "semantic": semantic_score,
+                 "hybrid": score}
+                for doc_id,bm25_score,semantic_score,score in zip(ids[top].tolist(),bm25[top].tolist(),
+                                                                  semantic[top].tolist(),fused.tolist())]
@@ -1,91 +1,125 @@
+import asyncio
 import os
+import time
 
-from inverted_index import InvertedIndex
+from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor
+from constants import BM25_IMPACT_BITS, HYBRID_SEARCH_WORKERS, QUERY_CACHE_PATH
+from inverted_index import BM25_MODES, load_or_build_index
+from segmented_index import SegmentedIndex
 from lib.chunked_semantic_search import ChunkedSemanticSearch
+from lib.fusion import FUSION_NORMALIZATIONS, FusionEngine, min_max, ranked_arrays
+
+def normalize_scores(scores):
+    return min_max(scores).tolist()
+
+def timed(timings, stage, function, *args):
+    # function(*args), with its wall time in milliseconds stored as
+    # timings[stage] when a timings dict is given
+    if timings is None:
+        return function(*args)
+    start = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        timings[stage] = (time.perf_counter()-start)*1000
 
-def hybrid_score(bm25_score, semantic_score, alpha=0.5):
-    return alpha * bm25_score + (1 - alpha) * semantic_score
-
-def rrf_score(rank, k=60):
-    return 1 / (k + rank)
-    
 class HybridSearch:
-    def __init__(self, documents):
+    def __init__(self, documents, bm25_mode="exhaustive", segmented=False, executor=None, model_name="all-MiniLM-L6-v2", model=None, impact_bits=None):
         self.documents = documents
-        self.semantic_search = ChunkedSemanticSearch()
+        self.bm25_mode = bm25_mode
+        self.segmented = segmented
+        # the BM25 and semantic legs of a query run side by side on this
+        # pool, so a query takes as long as the slower leg
+        self.executor = executor or ThreadPoolExecutor(HYBRID_SEARCH_WORKERS)
+        self.semantic_search = ChunkedSemanticSearch(model_name,query_cache_path=QUERY_CACHE_PATH,model=model)
         self.semantic_search.load_or_create_chunk_embeddings(documents)
 
-        self.idx = InvertedIndex()
-        if not os.path.exists(self.idx.index_path):
-            self.idx.build()
-            self.idx.save()
-
-    def _bm25_search(self, query, limit):
-        self.idx.load()
-        return self.idx.bm25_search(query, limit)
-
-    def weighted_search(self, query, alpha, limit=5):
-        bm25_results = self._bm25_search(query,limit*500)
-        semantic_results = self.semantic_search.search_chunks(query,limit*500)
-
-        bm25_scores = [score for (_,score) in bm25_results]
-        semantic_scores = [r["score"] for r in semantic_results]
-        
-        normalized_bm25 = self.normalize(bm25_scores)
-        normalized_semantic = self.normalize(semantic_scores)
-
-        combined = {}
-
-        for (doc_id,raw),norm_score in zip(bm25_results,normalized_bm25):
-            docu = next(doc for doc in self.documents if doc["id"] == doc_id)
-
-            combined[doc_id] = {"document": docu, "bm25": norm_score, "semantic": 0.0}
-
-        for result,norm_score in zip(semantic_results,normalized_semantic):
-            doc_id = result["id"]
-
-            if doc_id not in combined:
-                combined[doc_id] = {"document":result, "bm25":0.0,"semantic":norm_score}
-            else:
-                combined[doc_id]["semantic"] = norm_score
-
-        for doc_id in combined:
-            bm25_score = combined[doc_id]["bm25"]
-            semantic_score = combined[doc_id]["semantic"]
-
-            combined[doc_id]["hybrid"] = hybrid_score(bm25_score,semantic_score,alpha)
-
-        sorted_vals = sorted(combined.values(),key=lambda x: x["hybrid"], reverse=True)
-
-        return sorted_vals[:limit]
-
-    def rrf_search(self, query, k, limit=10):
-        bm25_results = self._bm25_search(query,limit*500)
-        semantic_results = self.semantic_search.search_chunks(query,limit*500)
-
-        combined = {}
-        
-        for rank,(doc_id,_) in enumerate(bm25_results,start=1):
-            document = next(doc for doc in self.documents if doc["id"] == doc_id)
-            combined[doc_id] = {"document": document, "bm25_rank": rank, "semantic_rank": None, "rrf":rrf_score(rank,k)}
-
-        for rank,result in enumerate(semantic_results,start=1):
-            doc_id = result["id"]
-            if doc_id not in combined:
-                combined[doc_id] = {"document": result, "bm25_rank": None, "semantic_rank": rank, "rrf":rrf_score(rank,k)}
-            else:
-                combined[doc_id]["semantic_rank"] = rank
-                combined[doc_id]["rrf"]+= rrf_score(rank,k)
-
-        return sorted(combined.values(),key=lambda x: x["rrf"],reverse=True)[:limit]
+        if segmented:
+            # the segment manifest is re-read per query, so documents added
+            # or deleted by another process show up without a restart
+            self.idx = SegmentedIndex()
+            try:
+                self.idx.load()
+            except FileNotFoundError:
+                self.idx.build(documents)
+        else:
+            # impact_bits asks for impact scores whatever the default mode,
+            # for callers that pick the mode per query
+            if impact_bits is None and bm25_mode == "impact":
+                impact_bits = BM25_IMPACT_BITS[0]
+            self.idx = load_or_build_index(impact_bits)
+
+        # documents by id, already decoded; ids only the index knows (added
+        # to a segmented index) are decoded from its docmap
+        self.fusion = FusionEngine(ChainMap(self.semantic_search.document_map,self.idx.docmap))
+
+    def _bm25_search(self, query, limit, bm25_mode=None):
+        # the single-file index is loaded once, in __init__
+        if self.segmented:
+            self.idx.load()
+        return self.idx.bm25_search(query, limit, bm25_mode or self.bm25_mode)
+
+    def _bm25_search_batch(self, queries, limit, bm25_mode=None):
+        if self.segmented:
+            self.idx.load()
+            return [self.idx.bm25_search(query, limit, bm25_mode or self.bm25_mode) for query in queries]
+        return self.idx.bm25_search_batch(queries, limit, bm25_mode or self.bm25_mode)
+
+    def __bm25_leg(self, query, limit, bm25_mode):
+        return ranked_arrays(self._bm25_search(query,limit,bm25_mode))
+
+    def __semantic_leg(self, query, limit, timings=None):
+        embed_query = timed(timings,"embed",self.semantic_search.generate_embedding,query)
+        movies,scores = timed(timings,"semantic",self.semantic_search.rank_embedding,embed_query,limit)
+        return self.semantic_search.movie_ids[movies],scores
+
+    def __candidates(self, query, limit, bm25_mode=None, timings=None):
+        bm25 = self.executor.submit(timed,timings,"bm25",self.__bm25_leg,query,limit*500,bm25_mode)
+        semantic_ids,semantic_scores = self.__semantic_leg(query,limit*500,timings)
+        bm25_ids,bm25_scores = bm25.result()
+        return bm25_ids,bm25_scores,semantic_ids,semantic_scores
+
+    def __candidates_batch(self, queries, limit, bm25_mode=None):
+        bm25 = self.executor.submit(self._bm25_search_batch,queries,limit*500,bm25_mode)
+        semantic = self.semantic_search.rank_movies_batch(queries,limit*500)
+        return [(*ranked_arrays(ranked),self.semantic_search.movie_ids[movies],semantic_scores)
+                for ranked,(movies,semantic_scores) in zip(bm25.result(),semantic)]
+
+    async def __candidates_async(self, query, limit, bm25_mode=None):
+        # both legs go to the executor, so the event loop only waits
+        loop = asyncio.get_running_loop()
+        (bm25_ids,bm25_scores),(semantic_ids,semantic_scores) = await asyncio.gather(
+            loop.run_in_executor(self.executor,self.__bm25_leg,query,limit*500,bm25_mode),
+            loop.run_in_executor(self.executor,self.__semantic_leg,query,limit*500))
+        return bm25_ids,bm25_scores,semantic_ids,semantic_scores
+
+    # timings, when given, receives the milliseconds spent per stage:
+    # bm25, embed, semantic and fusion
+    def weighted_search(self, query, alpha, limit=5, normalization="minmax", bm25_mode=None, timings=None):
+        bm25_ids,bm25_scores,semantic_ids,semantic_scores = self.__candidates(query,limit,bm25_mode,timings)
+        return timed(timings,"fusion",self.fusion.weighted,bm25_ids,bm25_scores,semantic_ids,semantic_scores,alpha,limit,normalization)
+
+    def rrf_search(self, query, k, limit=10, bm25_mode=None, timings=None):
+        bm25_ids,_,semantic_ids,_ = self.__candidates(query,limit,bm25_mode,timings)
+        return timed(timings,"fusion",self.fusion.rrf,bm25_ids,semantic_ids,k,limit)
+
+    def weighted_search_batch(self, queries, alpha, limit=5, normalization="minmax", bm25_mode=None):
+        # weighted_search for many queries, retrieved through the batch APIs
+        return [self.fusion.weighted(bm25_ids,bm25_scores,semantic_ids,semantic_scores,alpha,limit,normalization)
+                for bm25_ids,bm25_scores,semantic_ids,semantic_scores in self.__candidates_batch(queries,limit,bm25_mode)]
+
+    def rrf_search_batch(self, queries, k, limit=10, bm25_mode=None):
+        return [self.fusion.rrf(bm25_ids,semantic_ids,k,limit)
+                for bm25_ids,_,semantic_ids,_ in self.__candidates_batch(queries,limit,bm25_mode)]
+
+    async def weighted_search_async(self, query, alpha, limit=5, normalization="minmax", bm25_mode=None):
+        bm25_ids,bm25_scores,semantic_ids,semantic_scores = await self.__candidates_async(query,limit,bm25_mode)
+        return self.fusion.weighted(bm25_ids,bm25_scores,semantic_ids,semantic_scores,alpha,limit,normalization)
+
+    async def rrf_search_async(self, query, k, limit=10, bm25_mode=None):
+        bm25_ids,_,semantic_ids,_ = await self.__candidates_async(query,limit,bm25_mode)
+        return self.fusion.rrf(bm25_ids,semantic_ids,k,limit)
 
     def normalize(self,scores):
-        max_num = max(scores)
-        min_num = min(scores)
-        if max_num == min_num:
-            for i in range(len(scores)):
-                scores[i] = 1.0
-        else:
-            for i,score in enumerate(scores):
-                scores[i] = (score - min_num) / (max_num-min_num)
-        return scores
+        return normalize_scores(scores)
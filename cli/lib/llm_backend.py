@@ -0,0 +1,202 @@
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+import zlib
+
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from constants import *
+from lib.llm_client import RateLimitError
+
+LLM_BACKENDS = ("gemini","local")
+
+LLMResponse = namedtuple("LLMResponse",["text","prompt_tokens","response_tokens","seconds"])
+
+class LLMBackend(ABC):
+    # one provider behind one client that every call reuses. generate()
+    # takes a prompt, or a list of text parts and (bytes, mime type) images,
+    # and returns an LLMResponse. usage adds up what all calls cost:
+    # provider_seconds sums their latencies, busy_seconds is the wall time
+    # with at least one request in flight
+    name = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.usage = {"requests": 0, "prompt_tokens": 0, "response_tokens": 0,
+                      "provider_seconds": 0.0, "busy_seconds": 0.0}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.busy_since = 0.0
+
+    def begin(self):
+        with self.lock:
+            now = time.perf_counter()
+            if self.in_flight == 0:
+                self.busy_since = now
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight,self.in_flight)
+            return now
+
+    def end(self,start):
+        with self.lock:
+            now = time.perf_counter()
+            self.in_flight -= 1
+            self.usage["provider_seconds"] += now-start
+            if self.in_flight == 0:
+                self.usage["busy_seconds"] += now-self.busy_since
+            return now-start
+
+    def record(self,response):
+        with self.lock:
+            self.usage["requests"] += 1
+            self.usage["prompt_tokens"] += response.prompt_tokens
+            self.usage["response_tokens"] += response.response_tokens
+        return response
+
+    @abstractmethod
+    def generate(self,contents,model=LLM_MODEL):
+        pass
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self,api_key=None):
+        super().__init__()
+        self.api_key = api_key
+        self.client = None
+
+    def __client(self):
+        # created on the first request, so the key is only needed then; the
+        # client keeps its HTTP connections open for the calls after it
+        with self.lock:
+            if self.client is None:
+                from dotenv import load_dotenv
+                from google import genai
+                load_dotenv()
+                api_key = self.api_key or os.environ.get("GEMINI_API_KEY")
+                if not api_key:
+                    raise RuntimeError("GEMINI_API_KEY environment variable not set")
+                self.client = genai.Client(api_key=api_key)
+            return self.client
+
+    def generate(self,contents,model=LLM_MODEL):
+        from google.genai import errors, types
+        client = self.__client()
+        if isinstance(contents,list):
+            contents = [types.Part.from_bytes(data=part[0],mime_type=part[1]) if isinstance(part,tuple) else part
+                        for part in contents]
+        start = self.begin()
+        try:
+            response = client.models.generate_content(model=model,contents=contents)
+        except errors.APIError as e:
+            if e.code == 429:
+                raise RateLimitError(str(e)) from e
+            raise
+        finally:
+            seconds = self.end(start)
+        usage = response.usage_metadata
+        return self.record(LLMResponse(response.text.strip(),
+                                       (usage.prompt_token_count or 0) if usage else 0,
+                                       (usage.candidates_token_count or 0) if usage else 0,
+                                       seconds))
+
+def local_response(prompt):
+    # answers in the format each prompt of query_enhancement asks for, so
+    # pipelines run end to end; the same prompt always gets the same answer
+    def pick(*values):
+        return zlib.crc32(prompt.encode()+repr(values).encode())
+
+    if "Rate 0-10" in prompt:
+        return str(pick() % 11)
+    if "Return ONLY the movie IDs" in prompt:
+        ids = [int(doc_id) for doc_id in re.findall(r"^\s*(\d+): ",prompt,re.MULTILINE)]
+        return json.dumps(sorted(ids,key=pick))
+    if "on a 0-3 scale" in prompt:
+        results = re.findall(r"^\s*(\d+)\. ",prompt,re.MULTILINE)
+        return json.dumps([pick(result) % 4 for result in results])
+    query = re.search(r'User query: "(.*)"',prompt)
+    if query:
+        return query.group(1)
+    return f"Local answer to a prompt of {len(prompt.split())} words."
+
+class LocalLLMBackend(LLMBackend):
+    # a stand-in for the provider that runs offline: answers come from
+    # respond (local_response by default) after latency seconds plus up to
+    # jitter more, a rate_limit_rate share of requests fail with
+    # RateLimitError, and tokens are counted as words (images as
+    # LLM_LOCAL_IMAGE_TOKENS)
+    name = "local"
+
+    def __init__(self,latency=LLM_LOCAL_LATENCY,jitter=0.0,rate_limit_rate=0.0,respond=None,seed=0):
+        super().__init__()
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.respond = respond or local_response
+        self.rng = random.Random(seed)
+
+    def __request(self,contents):
+        if isinstance(contents,str):
+            contents = [contents]
+        text = "\n".join(part for part in contents if isinstance(part,str))
+        prompt_tokens = len(text.split()) + LLM_LOCAL_IMAGE_TOKENS*sum(isinstance(part,tuple) for part in contents)
+        with self.lock:
+            delay = self.latency+self.rng.uniform(0,self.jitter)
+            limited = self.rng.random() < self.rate_limit_rate
+        return text,prompt_tokens,delay,limited
+
+    def __response(self,text,prompt_tokens,limited,seconds):
+        if limited:
+            raise RateLimitError("local backend rate limit")
+        answer = self.respond(text)
+        return self.record(LLMResponse(answer,prompt_tokens,len(answer.split()),seconds))
+
+    def generate(self,contents,model=LLM_MODEL):
+        text,prompt_tokens,delay,limited = self.__request(contents)
+        start = self.begin()
+        try:
+            time.sleep(delay)
+        finally:
+            seconds = self.end(start)
+        return self.__response(text,prompt_tokens,limited,seconds)
+
+    async def agenerate(self,contents,model=LLM_MODEL):
+        # generate() for an event loop: waits without holding a thread
+        text,prompt_tokens,delay,limited = self.__request(contents)
+        start = self.begin()
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            seconds = self.end(start)
+        return self.__response(text,prompt_tokens,limited,seconds)
+
+def make_llm_backend(name=None,latency=None):
+    name = name or os.environ.get(LLM_BACKEND_ENV) or LLM_BACKEND
+    if name == "gemini":
+        return GeminiBackend()
+    if name == "local":
+        if latency is None:
+            latency = float(os.environ.get(LLM_LOCAL_LATENCY_ENV,LLM_LOCAL_LATENCY))
+        return LocalLLMBackend(latency)
+    raise ValueError(f"Unknown LLM backend '{name}', expected one of {LLM_BACKENDS}")
+
+llm_backend = None
+llm_backend_lock = threading.Lock()
+
+def get_llm_backend():
+    # the backend every call in this process shares, chosen by
+    # $RAGSEARCH_LLM_BACKEND unless set_llm_backend picked one
+    global llm_backend
+    with llm_backend_lock:
+        if llm_backend is None:
+            llm_backend = make_llm_backend()
+        return llm_backend
+
+def set_llm_backend(backend):
+    global llm_backend
+    with llm_backend_lock:
+        llm_backend = backend
@@ -0,0 +1,83 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from constants import *
+
+class LLMResponseCache():
+    # LLM responses in a sqlite file, keyed by a hash of model name and
+    # prompt. Entries older than ttl seconds count as misses and are dropped;
+    # beyond capacity entries the least recently used ones are evicted
+    def __init__(self,path=LLM_CACHE_PATH,ttl=LLM_CACHE_TTL,capacity=LLM_CACHE_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        os.makedirs(os.path.dirname(path) or ".",exist_ok=True)
+        self.db = sqlite3.connect(path,check_same_thread=False)
+        # WAL without a sync per commit keeps a hit, which records its use,
+        # in the microsecond range
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS llm_responses "
+                        "(key TEXT PRIMARY KEY, model TEXT, response TEXT, created REAL, used REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS llm_responses_used ON llm_responses (used)")
+        self.db.commit()
+
+    def key(self,model,prompt):
+        return hashlib.sha256(f"{model}\0{prompt}".encode()).hexdigest()
+
+    def get(self,model,prompt):
+        key = self.key(model,prompt)
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT response, created FROM llm_responses WHERE key = ?",(key,)).fetchone()
+            if row is not None and self.ttl and now-row[1] > self.ttl:
+                self.db.execute("DELETE FROM llm_responses WHERE key = ?",(key,))
+                self.db.commit()
+                self.expired += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE llm_responses SET used = ? WHERE key = ?",(now,key))
+            self.db.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self,model,prompt,response):
+        now = time.time()
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO llm_responses VALUES (?, ?, ?, ?, ?)",
+                            (self.key(model,prompt),model,response,now,now))
+            excess = self.db.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]-self.capacity
+            if excess > 0:
+                self.db.execute("DELETE FROM llm_responses WHERE key IN "
+                                "(SELECT key FROM llm_responses ORDER BY used LIMIT ?)",(excess,))
+                self.evictions += excess
+            self.db.commit()
+
+    def get_or_compute(self,model,prompt,compute):
+        response = self.get(model,prompt)
+        if response is None:
+            response = compute(prompt)
+            self.put(model,prompt,response)
+        return response
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            size = self.db.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "expired": self.expired, "evictions": self.evictions,
+                    "hit_rate": self.hits/lookups if lookups else 0.0, "size": size}
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -0,0 +1,114 @@
+import asyncio
+import inspect
+import random
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from constants import *
+
+class RateLimitError(RuntimeError):
+    # raised by a backend when the provider answers 429; retry_after is the
+    # wait it asked for in seconds, if it named one
+    def __init__(self,message="rate limited",retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TokenBucket():
+    # rate requests per second with bursts of up to capacity. Every caller
+    # reserves the next slot, so tokens go negative while callers queue and
+    # each one sleeps until its own slot comes up, in arrival order
+    def __init__(self,rate,capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.capacity,self.tokens+(now-self.updated)*self.rate)-1
+        self.updated = now
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens/self.rate)
+
+class AsyncLLMClient():
+    # sends prompts through generate, a function of prompt -> response
+    # (a coroutine function, or a blocking one that is run in a thread), with
+    # at most concurrency requests in flight, at most rate requests started
+    # per second, rate limit errors retried with exponential backoff and
+    # every attempt bounded by timeout seconds. A blocking call that timed
+    # out cannot be stopped, so it keeps one of the concurrency threads
+    # until it returns. A client belongs to the event loop it is first used in
+    def __init__(self,generate,concurrency=LLM_CONCURRENCY,rate=LLM_REQUESTS_PER_SECOND,burst=LLM_BURST,
+                 retries=LLM_MAX_RETRIES,timeout=LLM_REQUEST_TIMEOUT,backoff=LLM_BACKOFF_SECONDS):
+        self.generate = generate
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.executor = None
+        if not inspect.iscoroutinefunction(generate):
+            self.executor = ThreadPoolExecutor(concurrency,thread_name_prefix="llm")
+        self.bucket = TokenBucket(rate,burst)
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.stats = {"requests": 0, "completed": 0, "retries": 0, "rate_limited": 0, "timeouts": 0, "failed": 0}
+
+    def __start(self,prompt):
+        if self.executor is None:
+            return asyncio.ensure_future(self.generate(prompt))
+        return asyncio.get_running_loop().run_in_executor(self.executor,self.generate,prompt)
+
+    async def complete(self,prompt):
+        self.stats["requests"] += 1
+        await self.semaphore.acquire()
+        call = None
+        try:
+            for attempt in range(self.retries+1):
+                await self.bucket.acquire()
+                call = self.__start(prompt)
+                try:
+                    # a thread is not cancelled with the wait, so it is shielded
+                    # and still tracked in call if the wait ends early
+                    response = await asyncio.wait_for(call if self.executor is None else asyncio.shield(call),self.timeout)
+                except RateLimitError as e:
+                    self.stats["rate_limited"] += 1
+                    if attempt == self.retries:
+                        self.stats["failed"] += 1
+                        raise
+                    self.stats["retries"] += 1
+                    # full jitter keeps retries of a burst from lining up again
+                    await asyncio.sleep(e.retry_after or random.uniform(0,self.backoff*2**attempt))
+                    continue
+                except TimeoutError:
+                    self.stats["timeouts"] += 1
+                    self.stats["failed"] += 1
+                    raise TimeoutError(f"LLM request timed out after {self.timeout}s")
+                except Exception:
+                    self.stats["failed"] += 1
+                    raise
+                self.stats["completed"] += 1
+                return response
+        finally:
+            # the slot of a call still running in its thread is given back
+            # when the call returns, not when the caller stops waiting
+            if call is not None and not call.done():
+                call.add_done_callback(lambda _: self.semaphore.release())
+            else:
+                self.semaphore.release()
+
+    async def stream(self,prompts):
+        # yields (position, response) in completion order; a prompt that
+        # failed yields its exception instead of a response
+        async def indexed(position,prompt):
+            try:
+                return position,await self.complete(prompt)
+            except Exception as e:
+                return position,e
+
+        tasks = [asyncio.ensure_future(indexed(position,prompt)) for position,prompt in enumerate(prompts)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -1,35 +1,32 @@
-from PIL import Image
-from sentence_transformers import SentenceTransformer
-
-from .semantic_search import cosine_similarity
+from .semantic_search import normalize_embeddings, similarity_scores, top_k
 
 class MultimodalSearch():
     def __init__(self, documents, model_name="clip-ViT-B-32"):
+        from sentence_transformers import SentenceTransformer
         self.model = SentenceTransformer(model_name)
         self.documents = documents
         self.texts = [f"{doc['title']}: {doc['description']}" for doc in documents]
-        self.text_embeddings = self.model.encode(self.texts, show_progress_bar=True)
+        self.text_embeddings = normalize_embeddings(self.model.encode(self.texts, show_progress_bar=True))
 
     def embed_image(self,image_path):
+        from PIL import Image
         image = Image.open(image_path)
         embedding = self.model.encode([image])[0]
         return embedding
 
     def search_with_image(self,image_path,limit=5):
         embedding = self.embed_image(image_path)
-        results = []
+        top,scores = top_k(similarity_scores(self.text_embeddings,embedding),limit)
 
-        for i, text_embedding in enumerate(self.text_embeddings):
-            score = cosine_similarity(embedding, text_embedding)
+        results = []
+        for i,score in zip(top.tolist(),scores.tolist()):
             doc = self.documents[i]
             results.append({"id": doc["id"],
                             "title": doc["title"],
                             "description": doc["description"],
                             "score": score,
                             })
-        
-        results.sort(key=lambda x: x["score"], reverse=True)
-        return results[:limit]
+        return results
 
 def verify_image_embedding(image_path):
     searcher = MultimodalSearch()
@@ -0,0 +1,165 @@
+import os
+
+import numpy as np
+
+from constants import *
+from index_file import source_fingerprint
+from lib.semantic_search import normalize_embeddings, similarity_scores
+from lib.ann_index import kmeans, nearest_centroids
+
+EMBEDDING_STORAGE = ("float32","float16","int8","pq")
+
+class QuantizedEmbeddings():
+    # compressed copy of a saved embedding matrix; searches score the codes
+    # and only candidates are rescored against the full-precision .npy, which
+    # stays memory mapped instead of being loaded
+    #   float16: half precision rows
+    #   int8:    per-dimension scale, code = round(x/scale)
+    #   pq:      product quantization, one byte per subspace of the vector
+    def __init__(self,source_path,storage="float16"):
+        if storage not in EMBEDDING_STORAGE[1:]:
+            raise ValueError(f"storage must be one of {EMBEDDING_STORAGE[1:]}")
+        self.source_path = source_path
+        self.storage = storage
+        self.path = f"{os.path.splitext(source_path)[0]}.{storage}.npz"
+        self.codes = None
+        self.scales = None
+        self.codebooks = None
+        self.dimensions = 0
+        self.source_fingerprint = (0,0)
+        self.full = None
+
+    def __len__(self):
+        return 0 if self.codes is None else len(self.codes)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.codes,self.scales,self.codebooks) if a is not None)
+
+    def __source(self):
+        if self.full is None:
+            self.full = np.load(self.source_path,mmap_mode="r")
+        return self.full
+
+    def build(self,seed=0):
+        self.full = None
+        full = self.__source()
+        self.dimensions = full.shape[1]
+        self.source_fingerprint = source_fingerprint(self.source_path)
+        rows = range(0,len(full),EMBEDDING_SCORE_BATCH_SIZE)
+
+        if self.storage == "float16":
+            self.codes = np.concatenate([normalize_embeddings(full[i:i+EMBEDDING_SCORE_BATCH_SIZE]).astype(np.float16) for i in rows]
+                                        or [np.zeros((0,self.dimensions),dtype=np.float16)])
+        elif self.storage == "int8":
+            peak = np.zeros(self.dimensions,dtype=np.float32)
+            for i in rows:
+                np.maximum(peak,np.abs(normalize_embeddings(full[i:i+EMBEDDING_SCORE_BATCH_SIZE])).max(axis=0,initial=0),out=peak)
+            self.scales = np.where(peak == 0,1,peak/127).astype(np.float32)
+            self.codes = np.concatenate([np.rint(normalize_embeddings(full[i:i+EMBEDDING_SCORE_BATCH_SIZE])/self.scales).astype(np.int8) for i in rows]
+                                        or [np.zeros((0,self.dimensions),dtype=np.int8)])
+        else:
+            self.__build_pq(full,np.random.default_rng(seed))
+
+    def __build_pq(self,full,rng):
+        # vectors are zero padded to a multiple of the subspace count; each
+        # subspace gets its own 256-entry euclidean codebook
+        subspaces = min(PQ_SUBSPACES,self.dimensions)
+        width = -(-self.dimensions//subspaces)
+        centroids = min(256,len(full))
+        sample_rows = np.sort(rng.choice(len(full),min(len(full),centroids*PQ_TRAIN_PER_CENTROID),replace=False))
+        sample = self.__split(normalize_embeddings(full[sample_rows]),subspaces,width)
+
+        self.codebooks = np.stack([kmeans(sample[:,m],centroids,PQ_KMEANS_ITERATIONS,rng,spherical=False)
+                                   for m in range(subspaces)])
+        self.codes = np.zeros((len(full),subspaces),dtype=np.uint8)
+        for i in range(0,len(full),EMBEDDING_SCORE_BATCH_SIZE):
+            block = self.__split(normalize_embeddings(full[i:i+EMBEDDING_SCORE_BATCH_SIZE]),subspaces,width)
+            for m in range(subspaces):
+                self.codes[i:i+len(block),m] = nearest_centroids(self.codebooks[m],block[:,m],spherical=False)
+
+    def __split(self,vectors,subspaces,width):
+        padded = np.zeros((len(vectors),subspaces*width),dtype=np.float32)
+        padded[:,:vectors.shape[1]] = vectors
+        return padded.reshape(len(vectors),subspaces,width)
+
+    def save(self):
+        arrays = {"codes": self.codes,
+                  "source_fingerprint": np.array(self.source_fingerprint,dtype=np.int64),
+                  "dimensions": np.array(self.dimensions,dtype=np.int64)}
+        if self.scales is not None:
+            arrays["scales"] = self.scales
+        if self.codebooks is not None:
+            arrays["codebooks"] = self.codebooks
+        np.savez(self.path,**arrays)
+
+    def load(self):
+        try:
+            data = np.load(self.path)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"{self.storage} embeddings not found. Rebuild them from {self.source_path}.")
+        self.codes = data["codes"]
+        self.scales = data["scales"] if "scales" in data else None
+        self.codebooks = data["codebooks"] if "codebooks" in data else None
+        self.dimensions = int(data["dimensions"])
+        self.source_fingerprint = tuple(data["source_fingerprint"].tolist())
+        self.full = None
+
+    def is_stale(self):
+        return self.source_fingerprint != source_fingerprint(self.source_path)
+
+    def load_or_build(self):
+        try:
+            self.load()
+            rebuild = self.is_stale()
+        except FileNotFoundError:
+            rebuild = True
+        if rebuild:
+            self.build()
+            self.save()
+        return self
+
+    def scores(self,query,rows=None):
+        # approximate cosine similarity of the query to every row (or to
+        # rows), decoded a block at a time
+        query = normalize_embeddings(query)
+        codes = self.codes if rows is None else self.codes[rows]
+        if self.storage == "pq":
+            subspaces,centroids,width = self.codebooks.shape
+            split = np.zeros(subspaces*width,dtype=np.float32)
+            split[:len(query)] = query
+            table = np.einsum("mkw,mw->mk",self.codebooks,split.reshape(subspaces,width))
+            # codes index the flattened table: subspace m, centroid c -> m*centroids+c
+            table = table.ravel()
+            base = np.arange(subspaces,dtype=np.intp)*centroids
+            return np.concatenate([table[codes[i:i+EMBEDDING_SCORE_BATCH_SIZE]+base].sum(axis=1)
+                                   for i in range(0,len(codes),EMBEDDING_SCORE_BATCH_SIZE)] or [np.zeros(0,dtype=np.float32)])
+
+        if self.storage == "int8":
+            query = query*self.scales
+        return np.concatenate([codes[i:i+EMBEDDING_SCORE_BATCH_SIZE].astype(np.float32) @ query
+                               for i in range(0,len(codes),EMBEDDING_SCORE_BATCH_SIZE)] or [np.zeros(0,dtype=np.float32)])
+
+    def score_matrix(self,queries):
+        # scores() of a block of queries against every row: each block of
+        # codes is decoded once for all of them
+        queries = normalize_embeddings(queries)
+        blocks = range(0,len(self.codes),EMBEDDING_SCORE_BATCH_SIZE)
+        if self.storage == "pq":
+            subspaces,centroids,width = self.codebooks.shape
+            split = np.zeros((len(queries),subspaces*width),dtype=np.float32)
+            split[:,:queries.shape[1]] = queries
+            tables = np.einsum("mkw,qmw->qmk",self.codebooks,split.reshape(len(queries),subspaces,width))
+            tables = tables.reshape(len(queries),subspaces*centroids)
+            base = np.arange(subspaces,dtype=np.intp)*centroids
+            return np.concatenate([tables[:,self.codes[i:i+EMBEDDING_SCORE_BATCH_SIZE]+base].sum(axis=2) for i in blocks]
+                                  or [np.zeros((len(queries),0),dtype=np.float32)],axis=1)
+
+        if self.storage == "int8":
+            queries = queries*self.scales
+        return np.concatenate([queries @ self.codes[i:i+EMBEDDING_SCORE_BATCH_SIZE].astype(np.float32).T for i in blocks]
+                              or [np.zeros((len(queries),0),dtype=np.float32)],axis=1)
+
+    def exact_scores(self,query,rows):
+        rows = np.sort(rows)
+        return rows,similarity_scores(normalize_embeddings(self.__source()[rows]),query)
@@ -0,0 +1,91 @@
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from collections import OrderedDict
+from constants import *
+
+class QueryEmbeddingCache():
+    # query vectors keyed by model name and normalized query text: a bounded
+    # in-process LRU in front of an optional sqlite file that outlives the
+    # process. Lookups that fall through to the model count as misses.
+    # Normalizing only collapses whitespace; lowercase is for uncased models,
+    # where case cannot change the vector
+    def __init__(self,model_name,capacity=QUERY_CACHE_SIZE,path=None,lowercase=False):
+        self.model_name = model_name
+        self.lowercase = lowercase
+        # rows written under one normalization never answer the other
+        self.model_key = f"{model_name}:lowercase" if lowercase else model_name
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.db = None
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".",exist_ok=True)
+            self.db = sqlite3.connect(path,check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS query_vectors "
+                            "(model TEXT, query TEXT, dtype TEXT, vector BLOB, PRIMARY KEY (model, query))")
+            self.db.commit()
+
+    def normalize(self,query):
+        return " ".join((query.lower() if self.lowercase else query).split())
+
+    def __remember(self,key,vector):
+        self.entries[key] = vector
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def get(self,query):
+        key = self.normalize(query)
+        with self.lock:
+            vector = self.entries.get(key)
+            if vector is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return vector
+            if self.db is not None:
+                row = self.db.execute("SELECT dtype, vector FROM query_vectors WHERE model = ? AND query = ?",
+                                      (self.model_key,key)).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[1],dtype=row[0])
+                    self.__remember(key,vector)
+                    self.disk_hits += 1
+                    return vector
+            self.misses += 1
+            return None
+
+    def put(self,query,vector):
+        key = self.normalize(query)
+        vector = np.array(vector)
+        vector.flags.writeable = False
+        with self.lock:
+            self.__remember(key,vector)
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO query_vectors VALUES (?, ?, ?, ?)",
+                                (self.model_key,key,vector.dtype.str,vector.tobytes()))
+                self.db.commit()
+
+    def get_or_compute(self,query,compute):
+        vector = self.get(query)
+        if vector is None:
+            vector = compute(query)
+            self.put(query,vector)
+        return vector
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "hit_rate": (self.hits + self.disk_hits)/lookups if lookups else 0.0,
+                    "size": len(self.entries)}
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
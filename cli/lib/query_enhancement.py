@@ -1,6 +1,8 @@
 import os
-from dotenv import load_dotenv
-from google import genai
+import threading
+
+from constants import LLM_BACKEND, LLM_BACKEND_ENV, LLM_CACHE_ENV, LLM_CACHE_PATH, LLM_MODEL
+from lib.llm_backend import LLM_BACKENDS, get_llm_backend, make_llm_backend, set_llm_backend
 
 def spell_check(query):
     prompt=f"""Fix any spelling errors in the user-provided movie search query below.
@@ -182,18 +184,59 @@ def question_results(question,context):
 
     return prompt
 
-def enhance_query(prompt):
-    load_dotenv()
-    api_key = os.environ.get("GEMINI_API_KEY")
-    client = genai.Client(api_key=api_key)
-
-    if not api_key:
-        raise RuntimeError("GEMINI_API_KEY environment variable not set")
-
-    response = client.models.generate_content(model="gemma-3-27b-it",contents=prompt)
-
-    usage = response.usage_metadata
-    print(f"\n Prompt tokens: {usage.prompt_token_count}")
-    print(f"Response tokens: {usage.candidates_token_count}")
-
-    return response.text.strip()
+llm_cache = None
+llm_cache_lock = threading.Lock()
+
+def get_llm_cache():
+    # the response cache shared by every call in this process, opened on
+    # first use; None when bypassed through the environment
+    global llm_cache
+    if os.environ.get(LLM_CACHE_ENV,"").lower() in ("0","off","false","no"):
+        return None
+    with llm_cache_lock:
+        if llm_cache is None:
+            from lib.llm_cache import LLMResponseCache
+            llm_cache = LLMResponseCache(LLM_CACHE_PATH)
+    return llm_cache
+
+def bypass_llm_cache():
+    os.environ[LLM_CACHE_ENV] = "off"
+
+def add_llm_arguments(parser):
+    parser.add_argument("--llm-backend",type=str,choices=LLM_BACKENDS,default=None,help=f"LLM backend to use (default: ${LLM_BACKEND_ENV} or {LLM_BACKEND})")
+    parser.add_argument("--llm-latency",type=float,default=None,help="Seconds the local backend takes per request")
+    parser.add_argument("--no-llm-cache",action="store_true",help="Send every prompt to the backend instead of reusing cached responses")
+    parser.add_argument("--llm-stats",action="store_true",help="Print LLM usage and how much of the run was spent waiting on the backend")
+
+def configure_llm(args):
+    if getattr(args,"llm_backend",None) or getattr(args,"llm_latency",None) is not None:
+        set_llm_backend(make_llm_backend(args.llm_backend,args.llm_latency))
+    if getattr(args,"no_llm_cache",False):
+        bypass_llm_cache()
+
+def print_llm_stats(elapsed):
+    # the run minus the time some backend request was in flight is what the
+    # pipeline itself cost
+    backend = get_llm_backend()
+    usage = backend.usage
+    print(f"\nLLM backend: {backend.name}")
+    print(f"  requests: {usage['requests']}, prompt tokens: {usage['prompt_tokens']}, response tokens: {usage['response_tokens']}")
+    print(f"  backend latency: {usage['provider_seconds']:.3f}s summed over requests, {usage['busy_seconds']:.3f}s of wall time")
+    print(f"  run: {elapsed:.3f}s, of which pipeline without backend: {max(0.0,elapsed-usage['busy_seconds']):.3f}s")
+    if llm_cache is not None:
+        stats = llm_cache.stats()
+        print(f"  response cache: {stats['hits']} hits, {stats['misses']} misses, hit rate {stats['hit_rate']:.2f}")
+
+def enhance_query(prompt,model=LLM_MODEL):
+    # an identical prompt to the same backend and model is answered from
+    # the cache
+    backend = get_llm_backend()
+
+    def generate(prompt):
+        # token counts add up in backend.usage, shown by print_llm_stats
+        return backend.generate(prompt,model).text
+
+    cache = get_llm_cache()
+    if cache is None:
+        return generate(prompt)
+    return cache.get_or_compute(f"{backend.name}/{model}",prompt,generate)
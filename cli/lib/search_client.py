@@ -0,0 +1,53 @@
+import json
+import os
+
+from constants import *
+
+class SearchClient():
+    # talks to a running search_server_cli.py; every call is one POST
+    def __init__(self,url,timeout=SEARCH_CLIENT_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def call(self,command,**params):
+        # urllib pulls in ssl and email parsing; local runs never need it
+        import urllib.error
+        import urllib.request
+        request = urllib.request.Request(f"{self.url}/{command}",data=json.dumps(params).encode(),
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request,timeout=self.timeout) as response:
+                payload = json.load(response)
+        except urllib.error.HTTPError as e:
+            payload = json.load(e)
+            raise RuntimeError(f"search server: {payload.get('error',e.reason)}")
+        except urllib.error.URLError as e:
+            raise ConnectionError(f"search server at {self.url} is not reachable: {e.reason}")
+        return payload["result"]
+
+def server_url(url=None):
+    # an explicit --server wins over the environment; None means run locally
+    return url or os.environ.get(SEARCH_SERVER_ENV) or None
+
+class RemoteChunkedSemanticSearch():
+    def __init__(self,client):
+        self.client = client
+
+    def search(self,query,limit):
+        return self.client.call("search",query=query,limit=limit)
+
+    def search_chunks(self,query,limit=10,nprobe=None):
+        return self.client.call("search_chunked",query=query,limit=limit,nprobe=nprobe)
+
+class RemoteHybridSearch():
+    # same result shapes as HybridSearch, computed by the server
+    def __init__(self,client,bm25_mode="exhaustive"):
+        self.client = client
+        self.bm25_mode = bm25_mode
+
+    def weighted_search(self,query,alpha,limit=5,normalization="minmax"):
+        return self.client.call("weighted-search",query=query,alpha=alpha,limit=limit,bm25_mode=self.bm25_mode,
+                                normalization=normalization)
+
+    def rrf_search(self,query,k,limit=10):
+        return self.client.call("rrf-search",query=query,k=k,limit=limit,bm25_mode=self.bm25_mode)
@@ -0,0 +1,157 @@
+import json
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from constants import *
+
+class SearchService():
+    # the state a search server keeps warm between requests: documents,
+    # indexes and models are loaded on first use (or by warm()) and shared
+    # by every request after that
+    def __init__(self,documents_path="data/movies.json"):
+        self.documents_path = documents_path
+        self.lock = threading.RLock()
+        self.started = time.time()
+        self.requests = 0
+        self.documents = None
+        self.index = None
+        self.hybrid = None
+        self.semantic = None
+        self.cross_encoder = None
+
+    def __documents(self):
+        with self.lock:
+            if self.documents is None:
+                with open(self.documents_path,"r") as f:
+                    self.documents = json.load(f)["movies"]
+            return self.documents
+
+    def __index(self):
+        # the hybrid search's index when it is loaded, so both serve the
+        # same mapping of the same, up to date file
+        from inverted_index import load_or_build_index
+        with self.lock:
+            if self.index is None:
+                self.index = self.hybrid.idx if self.hybrid is not None else load_or_build_index(BM25_IMPACT_BITS[0])
+            return self.index
+
+    def __hybrid(self):
+        from lib.hybrid_search import HybridSearch
+        with self.lock:
+            if self.hybrid is None:
+                # requests pick the BM25 mode, so the index keeps impact
+                # scores and serves every one of BM25_MODES
+                self.hybrid = HybridSearch(self.__documents(),impact_bits=BM25_IMPACT_BITS[0])
+            return self.hybrid
+
+    def __semantic(self):
+        from lib.semantic_search import SemanticSearch
+        with self.lock:
+            if self.semantic is None:
+                semantic = SemanticSearch(query_cache_path=QUERY_CACHE_PATH)
+                semantic.load_or_create_embeddings(self.__documents())
+                self.semantic = semantic
+            return self.semantic
+
+    def warm(self):
+        self.__hybrid()
+        self.__index()
+
+    def bm25_search(self,query,limit=5,mode="exhaustive",segments=False):
+        if segments:
+            # the manifest is re-read per request so updates show up live
+            from segmented_index import SegmentedIndex
+            index = SegmentedIndex()
+            index.load()
+        else:
+            index = self.__index()
+        return [{"id": doc_id, "title": index.docmap[doc_id]["title"], "score": score}
+                for doc_id,score in index.bm25_search(query,limit,mode)]
+
+    def semantic_search(self,query,limit=5):
+        return self.__semantic().search(query,limit)
+
+    def search_chunks(self,query,limit=5,nprobe=None):
+        semantic = self.__hybrid().semantic_search
+        if nprobe is not None:
+            with self.lock:
+                if semantic.ann_index is None:
+                    semantic.load_or_create_ann_index()
+        return semantic.search_chunks(query,limit,nprobe)
+
+    def weighted_search(self,query,alpha=0.5,limit=5,bm25_mode="exhaustive",normalization="minmax"):
+        return self.__hybrid().weighted_search(query,alpha,limit,normalization,bm25_mode)
+
+    def rrf_search(self,query,k=60,limit=5,bm25_mode="exhaustive"):
+        return self.__hybrid().rrf_search(query,k,limit,bm25_mode)
+
+    def cross_encode(self,pairs):
+        with self.lock:
+            if self.cross_encoder is None:
+                from sentence_transformers import CrossEncoder
+                self.cross_encoder = CrossEncoder("cross-encoder/ms-marco-TinyBERT-L2-v2")
+            return [float(score) for score in self.cross_encoder.predict(pairs)]
+
+    def status(self):
+        status = {"uptime": time.time()-self.started, "requests": self.requests,
+                  "loaded": [name for name in ("documents","index","hybrid","semantic","cross_encoder")
+                             if getattr(self,name) is not None]}
+        if self.hybrid is not None:
+            status["query_cache"] = self.hybrid.semantic_search.query_cache.stats()
+        return status
+
+SERVICE_METHODS = {
+    "bm25search": "bm25_search",
+    "search": "semantic_search",
+    "search_chunked": "search_chunks",
+    "weighted-search": "weighted_search",
+    "rrf-search": "rrf_search",
+    "cross-encode": "cross_encode",
+    "status": "status",
+}
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    # POST /<command> with a JSON object of keyword arguments; answers
+    # {"result": ..., "elapsed_ms": ...} or {"error": ...}
+    def do_POST(self):
+        command = self.path.strip("/")
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get("Content-Length",0))
+            params = json.loads(self.rfile.read(length) or b"{}")
+            if command == "shutdown":
+                # answer first: the process exits as soon as serve_forever returns
+                self.__reply(200,{"result": "shutting down", "elapsed_ms": 0.0})
+                self.wfile.flush()
+                threading.Thread(target=self.server.shutdown,daemon=True).start()
+                return
+            if command not in SERVICE_METHODS:
+                return self.__reply(404,{"error": f"unknown command '{command}'"})
+            result = getattr(self.server.service,SERVICE_METHODS[command])(**params)
+        except (TypeError,ValueError,KeyError) as e:
+            return self.__reply(400,{"error": f"{type(e).__name__}: {e}"})
+        except Exception as e:
+            return self.__reply(500,{"error": f"{type(e).__name__}: {e}"})
+        self.server.service.requests += 1
+        self.__reply(200,{"result": result, "elapsed_ms": (time.perf_counter()-start)*1000})
+
+    def __reply(self,status,payload):
+        body = json.dumps(payload,default=float).encode()
+        self.send_response(status)
+        self.send_header("Content-Type","application/json")
+        self.send_header("Content-Length",str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):
+        pass
+
+def serve(service,host=SEARCH_SERVER_HOST,port=SEARCH_SERVER_PORT):
+    server = ThreadingHTTPServer((host,port),SearchRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
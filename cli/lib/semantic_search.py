@@ -3,7 +3,9 @@ import os
 import re
 import numpy as np
 
-from sentence_transformers import SentenceTransformer
+from constants import *
+from lib.embedding_cache import EmbeddingCache
+from lib.query_cache import QueryEmbeddingCache
 
 def verify_model():
     searcher = SemanticSearch()
@@ -25,6 +27,8 @@ def verify_embeddings():
     embeddings = searcher.load_or_create_embeddings(documents["movies"])
     print(f"Number of docs:   {len(documents)}")
     print(f"Embeddings shape: {embeddings.shape[0]} vectors in {embeddings.shape[1]} dimensions")
+    stats = searcher.embedding_stats
+    print(f"Encoded {stats['encoded']}, reused {stats['reused']}, dropped {stats['dropped']}")
 
 def embed_query_text(query):
     searcher = SemanticSearch()
@@ -43,6 +47,42 @@ def cosine_similarity(vec1, vec2):
 
     return dot_product / (norm1 * norm2) 
 
+def normalize_embeddings(embeddings):
+    # unit rows turn cosine similarity into a plain dot product; zero
+    # vectors stay zero and score 0 against everything
+    embeddings = np.asarray(embeddings,dtype=np.float32)
+    norms = np.linalg.norm(embeddings,axis=-1,keepdims=True)
+    return embeddings/np.where(norms == 0,1,norms)
+
+def similarity_scores(embeddings,query):
+    return embeddings @ normalize_embeddings(query)
+
+def similarity_matrix(embeddings,queries):
+    # one row of similarity_scores per query, as a single matrix product
+    return normalize_embeddings(queries) @ embeddings.T
+
+def top_k(scores,limit):
+    # positions and scores of the limit best entries, best first; only the
+    # winners are sorted and ties keep their original order, also across
+    # the cutoff, as a stable sort of all scores would
+    limit = max(0,min(limit,len(scores)))
+    if limit == 0:
+        top = np.zeros(0,dtype=np.intp)
+    elif limit < len(scores):
+        threshold = scores[np.argpartition(-scores,limit-1)[limit-1]]
+        above = np.flatnonzero(scores > threshold)
+        top = np.concatenate([above,np.flatnonzero(scores == threshold)[:limit-len(above)]])
+    else:
+        top = np.arange(len(scores))
+    top = top[np.lexsort((top,-scores[top]))]
+    return top,scores[top]
+
+def rescore(quantized,query,rows,limit):
+    # exact similarities for candidate rows picked on compressed codes
+    rows,exact = quantized.exact_scores(query,rows)
+    top,scores = top_k(exact,limit)
+    return rows[top],scores
+
 def semantic_chunk(text,chunk_size,overlap_int):
     text = text.strip()
     if not text:
@@ -65,55 +105,115 @@ def semantic_chunk(text,chunk_size,overlap_int):
     return chunks
 
 class SemanticSearch():
-    def __init__(self,model_name = "all-MiniLM-L6-v2"):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self,model_name = "all-MiniLM-L6-v2",storage="float32",rescore=True,query_cache_path=None,model=None):
+        # model may be any encoder with the SentenceTransformer encode API;
+        # model_name still keys the embedding caches
+        if model is None:
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(model_name)
+        self.model = model
+        self.model_name = model_name
+        self.query_cache = QueryEmbeddingCache(model_name,path=query_cache_path)
         self.embeddings = None
+        self.quantized = None
+        self.embedding_stats = None
+        self.storage = storage
+        self.rescore = rescore
         self.documents = None
         self.document_map = {}
 
+    def open_storage(self,path,embeddings):
+        # float32 keeps the normalized matrix in memory; the compressed modes
+        # keep only their codes and map the full-precision file for rescoring
+        if self.storage == "float32":
+            return normalize_embeddings(embeddings),None
+        from lib.quantized_embeddings import QuantizedEmbeddings
+        return np.load(path,mmap_mode="r"),QuantizedEmbeddings(path,self.storage).load_or_build()
 
     def generate_embedding(self,text):
         if text == "" or text is None:
             raise ValueError("Text only contains whitespace or is empty")
-        embedding = self.model.encode([text])
-        return embedding[0]
-
-    def build_embeddings(self,documents):
-        self.documents = documents
-        self.document_map = {}
-        all = []
+        return self.query_cache.get_or_compute(text,lambda text: self.model.encode([text])[0])
 
-        for movie in self.documents:
-            self.document_map[movie["id"]] = movie
-            all.append(f"{movie['title']}: {movie['description']}")
-        self.embeddings = self.model.encode(all,show_progress_bar=True)
+    def generate_embeddings(self,texts):
+        # query vectors for a list of texts; whatever the cache does not hold
+        # yet is encoded in a single model call
+        if any(text == "" or text is None for text in texts):
+            raise ValueError("Text only contains whitespace or is empty")
+        vectors = [self.query_cache.get(text) for text in texts]
+        missing = {}
+        for text,vector in zip(texts,vectors):
+            if vector is None:
+                missing.setdefault(self.query_cache.normalize(text),text)
+        if missing:
+            encoded = dict(zip(missing,self.model.encode(list(missing.values()))))
+            for key,text in missing.items():
+                self.query_cache.put(text,encoded[key])
+            vectors = [encoded[self.query_cache.normalize(text)] if vector is None else vector
+                       for text,vector in zip(texts,vectors)]
+        if not vectors:
+            return np.zeros((0,self.model.get_sentence_embedding_dimension()),dtype=np.float32)
+        return np.array(vectors,dtype=np.float32)
+
+    def encode_normalized(self,texts):
+        return normalize_embeddings(self.model.encode(texts))
 
-        np.save("cache/movie_embeddings.npy",self.embeddings)
+    def build_embeddings(self,documents):
+        # documents may be a stream from iter_movies; only texts the cache
+        # has no vector for are encoded, batch by batch
+        cache = EmbeddingCache("cache/movie_embeddings.npy",self.model_name)
+        texts = (f"{movie['title']}: {movie['description']}" for movie in documents)
+        embeddings = cache.refresh(texts,self.encode_normalized,self.model.get_sentence_embedding_dimension())
+        self.embedding_stats = cache.stats
+        self.embeddings,self.quantized = self.open_storage("cache/movie_embeddings.npy",embeddings)
         return self.embeddings
 
     def load_or_create_embeddings(self,documents):
-        self.documents = documents
+        # documents may be a stream such as iter_movies; they are read once
+        self.documents = list(documents)
         self.document_map = {}
 
         for movie in self.documents:
             self.document_map[movie["id"]] = movie
-
-        if os.path.exists("cache/movie_embeddings.npy"):
-            self.embeddings = np.load("cache/movie_embeddings.npy")
-
-            if len(self.embeddings) == len(self.documents):
-                return self.embeddings
-        return self.build_embeddings(documents)
+        return self.build_embeddings(self.documents)
 
     def search(self,query,limit):
-        results = []
-
         if self.embeddings is None:
             raise ValueError("No embeddings loaded. Call 'load_or_create_embeddings' first.")
 
         embedding = self.generate_embedding(query)
-        for idx,movie_embedding in enumerate(self.embeddings):
-            results.append((cosine_similarity(embedding,movie_embedding),self.documents[idx]))
-        sorted_scores = sorted(results,key=lambda x: x[0],reverse=True)
-        top_result = sorted_scores[:limit]
-        return [{"score": score, "title": doc["title"], "description":doc["description"]} for score,doc in top_result]
+        if self.quantized is None:
+            top,scores = top_k(similarity_scores(self.embeddings,embedding),limit)
+        elif self.rescore:
+            candidates,_ = top_k(self.quantized.scores(embedding),limit*EMBEDDING_RESCORE_FACTOR)
+            top,scores = rescore(self.quantized,embedding,candidates,limit)
+        else:
+            top,scores = top_k(self.quantized.scores(embedding),limit)
+        return self.__results(top,scores)
+
+    def search_batch(self,queries,limit):
+        # search() for many queries: one encoding call, then each block of
+        # QUERY_BATCH_SIZE queries is scored with one matrix product
+        if self.embeddings is None:
+            raise ValueError("No embeddings loaded. Call 'load_or_create_embeddings' first.")
+
+        embeddings = self.generate_embeddings(queries)
+        results = []
+        for start in range(0,len(embeddings),QUERY_BATCH_SIZE):
+            block = embeddings[start:start+QUERY_BATCH_SIZE]
+            if self.quantized is None:
+                block_scores = similarity_matrix(self.embeddings,block)
+            else:
+                block_scores = self.quantized.score_matrix(block)
+            for embedding,row in zip(block,block_scores):
+                if self.quantized is not None and self.rescore:
+                    candidates,_ = top_k(row,limit*EMBEDDING_RESCORE_FACTOR)
+                    top,scores = rescore(self.quantized,embedding,candidates,limit)
+                else:
+                    top,scores = top_k(row,limit)
+                results.append(self.__results(top,scores))
+        return results
+
+    def __results(self,top,scores):
+        return [{"score": float(score), "title": self.documents[idx]["title"], "description": self.documents[idx]["description"]}
+                for idx,score in zip(top.tolist(),scores.tolist())]
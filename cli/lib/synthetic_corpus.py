@@ -0,0 +1,124 @@
+import json
+import string
+import zlib
+
+import numpy as np
+
+from constants import *
+
+# the words of the shipped corpus head the vocabulary; generated words make
+# up the long tail, and function words are mixed in as in real descriptions
+CORE_WORDS = ("shark","hero","ice","jungle","mother","dog","robot","brother","light","bear","river","hunter",
+              "werewolf","forest","cat","zombie","king","fire","queen","mountain","money","night","travel",
+              "house","music","dark","villain","school","police","bank","sister","city","winter","ghost",
+              "boy","time","alien","power","ship","comedy","father","girl","dragon","war","space","love",
+              "paris","london","dinosaur","island","desert","army","car","train","dance","future","mystery",
+              "race","secret","storm","ocean","magic","detective","family","friend","spy","heist")
+FUNCTION_WORDS = ("the","a","an","and","of","to","in","is","it","that","this","with","for","on","by","they")
+SYLLABLES = ("ka","ro","mi","ta","ne","lo","su","ri","va","do","pe","zu","an","el","or","ix","um","sha","tor","vin")
+GENRES = ("action","comedy","drama","horror","romance","science fiction","thriller","animation","documentary","fantasy")
+
+def synthetic_vocabulary(size=SYNTHETIC_VOCABULARY_SIZE,seed=0):
+    rng = np.random.default_rng(seed)
+    vocabulary = list(dict.fromkeys(CORE_WORDS))
+    seen = set(vocabulary)
+    while len(vocabulary) < size:
+        word = "".join(SYLLABLES[i] for i in rng.integers(0,len(SYLLABLES),rng.integers(2,5)))
+        if word not in seen:
+            seen.add(word)
+            vocabulary.append(word)
+    return vocabulary[:size]
+
+def zipf_weights(size,exponent=1.07):
+    weights = 1/np.arange(1,size+1)**exponent
+    return weights/weights.sum()
+
+def generate_movies(count,seed=0,vocabulary_size=SYNTHETIC_VOCABULARY_SIZE,block_size=SYNTHETIC_BLOCK_SIZE):
+    # yields count movies with ids 1..count; the same seed always gives the
+    # same corpus. Words follow a Zipf distribution over the vocabulary so
+    # posting list lengths look like those of natural text
+    vocabulary = np.array(synthetic_vocabulary(vocabulary_size,seed))
+    weights = zipf_weights(len(vocabulary))
+    rng = np.random.default_rng(seed+1)
+    for start in range(0,count,block_size):
+        n = min(block_size,count-start)
+        sentences = rng.integers(1,6,n)
+        lengths = rng.integers(4,15,sentences.sum())
+        words = vocabulary[rng.choice(len(vocabulary),lengths.sum(),p=weights)]
+        function = rng.random(len(words)) < 0.25
+        words[function] = np.array(FUNCTION_WORDS)[rng.integers(0,len(FUNCTION_WORDS),function.sum())]
+        endings = np.array(list(".!?"))[rng.integers(0,3,len(lengths))]
+        title_words = vocabulary[rng.choice(len(vocabulary)//10,(n,3),p=zipf_weights(len(vocabulary)//10))]
+        title_lengths = rng.integers(1,4,n)
+        years = rng.integers(1920,2026,n)
+        genres = rng.integers(0,len(GENRES),n)
+        ratings = np.round(rng.uniform(1,10,n),1)
+        runtimes = rng.integers(70,200,n)
+
+        words = words.tolist()
+        ends = np.cumsum(lengths).tolist()
+        sentence = 0
+        for i in range(n):
+            parts = []
+            for _ in range(sentences[i]):
+                text = " ".join(words[ends[sentence]-lengths[sentence]:ends[sentence]])
+                parts.append(text[:1].upper() + text[1:] + endings[sentence])
+                sentence += 1
+            yield {"id": start+i+1,
+                   "title": " ".join(word.capitalize() for word in title_words[i][:title_lengths[i]]),
+                   "description": " ".join(parts),
+                   "year": int(years[i]),
+                   "genre": GENRES[genres[i]],
+                   "rating": float(ratings[i]),
+                   "runtime": int(runtimes[i])}
+
+def write_movies(path,count,seed=0,vocabulary_size=SYNTHETIC_VOCABULARY_SIZE):
+    # {"movies": [...]} like data/movies.json, written one movie at a time
+    with open(path,"w",encoding="utf-8") as f:
+        f.write('{"movies": [')
+        for i,movie in enumerate(generate_movies(count,seed,vocabulary_size)):
+            f.write((", " if i else "") + json.dumps(movie))
+        f.write("]}")
+
+def synthetic_queries(count,seed=0,vocabulary_size=SYNTHETIC_VOCABULARY_SIZE):
+    # one to four content words per query, drawn like description words
+    vocabulary = synthetic_vocabulary(vocabulary_size,seed)
+    rng = np.random.default_rng(seed+2)
+    lengths = rng.integers(1,5,count)
+    words = rng.choice(len(vocabulary),lengths.sum(),p=zipf_weights(len(vocabulary))).tolist()
+    ends = np.cumsum(lengths).tolist()
+    return [" ".join(vocabulary[w] for w in words[end-length:end]) for end,length in zip(ends,lengths.tolist())]
+
+class HashedWordEncoder():
+    # stands in for a SentenceTransformer: a text is the mean of fixed random
+    # vectors of its words, each word hashed to a row of the table. Texts
+    # sharing words get similar vectors, and nothing has to be downloaded
+    def __init__(self,dimensions=384,seed=0,rows=SYNTHETIC_EMBEDDING_ROWS):
+        self.dimensions = dimensions
+        self.max_seq_length = 256
+        self.table = np.random.default_rng(seed).standard_normal((rows,dimensions),dtype=np.float32)
+        self.rows = {}
+        self.punctuation = str.maketrans("","",string.punctuation)
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimensions
+
+    def __row(self,word):
+        row = self.rows.get(word)
+        if row is None:
+            row = self.rows[word] = zlib.crc32(word.encode()) % len(self.table)
+        return row
+
+    def encode(self,texts,**kwargs):
+        rows = []
+        counts = np.zeros(len(texts),dtype=np.int64)
+        for i,text in enumerate(texts):
+            words = text.lower().translate(self.punctuation).split()
+            rows.extend(self.__row(word) for word in words)
+            counts[i] = len(words)
+        vectors = np.zeros((len(texts),self.dimensions),dtype=np.float32)
+        found = counts > 0
+        if rows:
+            starts = np.cumsum(counts)-counts
+            vectors[found] = np.add.reduceat(self.table[rows],starts[found])/counts[found,None]
+        return vectors
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import time
+
+from constants import *
+from lib.llm_backend import LocalLLMBackend
+from lib.llm_client import AsyncLLMClient
+
+async def run_client(prompts,backend,concurrency,rate,burst,timeout,retries):
+    client = AsyncLLMClient(backend.agenerate,concurrency,rate,burst,retries,timeout)
+    start = time.perf_counter()
+    arrivals = []
+    failures = 0
+    async for _,response in client.stream(prompts):
+        arrivals.append(time.perf_counter()-start)
+        failures += isinstance(response,Exception)
+    return {"elapsed": time.perf_counter()-start, "first": arrivals[0] if arrivals else 0.0,
+            "failures": failures, "stats": client.stats, "max_in_flight": backend.max_in_flight}
+
+def report(label,run,requests):
+    stats = run["stats"]
+    print(f"{label}:")
+    print(f"  wall time:        {run['elapsed']:.2f}s ({requests/run['elapsed']:.2f} requests/s)")
+    print(f"  first response:   {run['first']:.2f}s")
+    print(f"  max in flight:    {run['max_in_flight']}")
+    print(f"  rate limited:     {stats['rate_limited']} ({stats['retries']} retried)")
+    print(f"  timeouts:         {stats['timeouts']}")
+    print(f"  failed:           {run['failures']}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the async LLM client against the local LLM backend")
+    parser.add_argument("--requests", type=int, default=25, help="Prompts to send, like reranking this many candidates")
+    parser.add_argument("--latency", type=float, default=0.5, help="Local backend latency per request in seconds")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Extra random latency of up to this many seconds")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests the local backend answers with a rate limit error")
+    parser.add_argument("--concurrency", type=int, default=LLM_CONCURRENCY, help="Requests in flight at once")
+    parser.add_argument("--rate", type=float, default=0.0, help="Requests started per second (0 = unlimited)")
+    parser.add_argument("--burst", type=int, default=LLM_BURST, help="Requests that may start at once before the rate applies")
+    parser.add_argument("--timeout", type=float, default=LLM_REQUEST_TIMEOUT, help="Timeout per request in seconds")
+    parser.add_argument("--retries", type=int, default=LLM_MAX_RETRIES, help="Retries of a rate limited request")
+    parser.add_argument("--sequential", action="store_true", help="Also run the prompts one at a time for comparison")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the local backend")
+    args = parser.parse_args()
+
+    prompts = [f"Rate candidate {i}" for i in range(args.requests)]
+    if args.sequential:
+        backend = LocalLLMBackend(args.latency,args.jitter,args.rate_limit_rate,seed=args.seed)
+        run = asyncio.run(run_client(prompts,backend,1,args.rate,args.burst,args.timeout,args.retries))
+        report("sequential",run,args.requests)
+    backend = LocalLLMBackend(args.latency,args.jitter,args.rate_limit_rate,seed=args.seed)
+    run = asyncio.run(run_client(prompts,backend,args.concurrency,args.rate,args.burst,args.timeout,args.retries))
+    report(f"concurrency {args.concurrency}",run,args.requests)
+
+if __name__ == "__main__":
+    main()
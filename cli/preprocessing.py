@@ -1,19 +1,50 @@
 import string
 
-from nltk.stem import PorterStemmer
+from constants import *
+from functools import lru_cache
 
-stemmer = PorterStemmer()
+stemmer = None
+
+# stemming is a pure function of the token and vocabularies are small next
+# to token counts, so one bounded cache is shared by every tokenizer. nltk
+# is only imported on the first miss
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(token):
+    global stemmer
+    if stemmer is None:
+        from nltk.stem import PorterStemmer
+        stemmer = PorterStemmer()
+    return stemmer.stem(token)
 
 def load_stopwords():
     with open("data/stopwords.txt","r") as f:
         return f.read().splitlines()
 
+class Tokenizer():
+    def __init__(self,stopwords=None):
+        if not stopwords:
+            stopwords = load_stopwords()
+        self.stopwords = frozenset(stopwords)
+        self.table = str.maketrans("","",string.punctuation)
+
+    def preprocess(self,text):
+        stopwords = self.stopwords
+        return [stem(t) for t in text.lower().translate(self.table).split() if t not in stopwords]
+
+    def preprocess_many(self,texts):
+        stopwords = self.stopwords
+        table = self.table
+        return [[stem(t) for t in text.lower().translate(table).split() if t not in stopwords] for text in texts]
+
+default_tokenizer = None
+
+def get_tokenizer(stopwords=None):
+    global default_tokenizer
+    if stopwords:
+        return Tokenizer(stopwords)
+    if default_tokenizer is None:
+        default_tokenizer = Tokenizer()
+    return default_tokenizer
+
 def preprocess(text,stopwords=None):
-    if not stopwords:
-        stopwords = load_stopwords()
-    text = text.lower().translate(str.maketrans("","",string.punctuation))
-    tokens = [t for t in text.split() if t]
-    tokens = [t for t in tokens if t not in stopwords and t != ""]
-    tokens = [stemmer.stem(t) for t in tokens]
-
-    return tokens
+    return get_tokenizer(stopwords).preprocess(text)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from constants import *
+
+CLI_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(CLI_DIR)
+
+BENCHMARK_COMPONENTS = ("bm25","semantic","hybrid")
+BENCHMARK_SIZES = (10_000,100_000,1_000_000)
+SYNTHETIC_MODEL_NAME = "synthetic-hashed-words"
+
+def file_bytes(*paths):
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+def query_latency(search,queries):
+    from lib.evaluation import latency_summary
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query)
+        timings.append((time.perf_counter()-start)*1000)
+    return latency_summary(timings)
+
+def measure_size(size,components,queries,dimensions,seed):
+    # runs in a scratch directory of its own: data/ holds the generated
+    # corpus and cache/ everything built from it
+    from corpus import iter_movies
+    from inverted_index import BM25_MODES, InvertedIndex
+    from preprocessing import load_stopwords
+    from lib.evaluation import peak_rss_mb
+    from lib.synthetic_corpus import HashedWordEncoder, synthetic_queries, write_movies
+
+    result = {"size": size}
+    os.makedirs("data",exist_ok=True)
+    shutil.copy(os.path.join(ROOT_DIR,"data","stopwords.txt"),"data/stopwords.txt")
+    start = time.perf_counter()
+    write_movies("data/movies.json",size,seed)
+    result["corpus"] = {"generate_s": time.perf_counter()-start, "bytes": file_bytes("data/movies.json")}
+    queries = synthetic_queries(queries,seed)
+
+    if "bm25" in components or "hybrid" in components:
+        index = InvertedIndex()
+        start = time.perf_counter()
+        index.build(iter_movies("data/movies.json"),load_stopwords())
+        build_s = time.perf_counter()-start
+        index.save()
+        del index
+        start = time.perf_counter()
+        index = InvertedIndex()
+        index.load()
+        result["bm25"] = {"build_s": build_s, "load_s": time.perf_counter()-start,
+                          "index_bytes": file_bytes(index.index_path), "query_ms": {}}
+        for mode in BM25_MODES:
+            if mode != "impact":
+                result["bm25"]["query_ms"][mode] = query_latency(lambda query: index.bm25_search(query,10,mode),queries)
+        del index
+
+        # impact scores are stored only when asked for, so impact mode gets
+        # an index of its own, next to the plain one
+        index = InvertedIndex()
+        index.index_path = "cache/index_impact.bin"
+        start = time.perf_counter()
+        index.build(iter_movies("data/movies.json"),load_stopwords(),BM25_IMPACT_BITS[0])
+        result["bm25"]["impact_build_s"] = time.perf_counter()-start
+        index.save()
+        del index
+        index = InvertedIndex()
+        index.index_path = "cache/index_impact.bin"
+        index.load()
+        result["bm25"]["impact_index_bytes"] = file_bytes(index.index_path)
+        result["bm25"]["query_ms"]["impact"] = query_latency(lambda query: index.bm25_search(query,10,"impact"),queries)
+        result["bm25"]["peak_rss_mb"] = peak_rss_mb()
+        del index
+
+    if "semantic" in components or "hybrid" in components:
+        from lib.chunked_semantic_search import ChunkedSemanticSearch
+        encoder = HashedWordEncoder(dimensions,seed)
+        documents = list(iter_movies("data/movies.json"))
+        semantic = ChunkedSemanticSearch(SYNTHETIC_MODEL_NAME,model=encoder)
+        start = time.perf_counter()
+        semantic.load_or_create_chunk_embeddings(documents)
+        build_s = time.perf_counter()-start
+        del semantic
+        # the second instance finds every chunk in the embedding cache
+        semantic = ChunkedSemanticSearch(SYNTHETIC_MODEL_NAME,model=encoder)
+        start = time.perf_counter()
+        semantic.load_or_create_chunk_embeddings(documents)
+        result["semantic"] = {"build_s": build_s, "load_s": time.perf_counter()-start,
+                              "chunks": len(semantic.chunk_embeddings),
+                              "embedding_bytes": file_bytes("cache/chunk_embeddings.npy","cache/chunk_embeddings.keys.npy",
+                                                            "cache/chunk_metadata.npz"),
+                              "query_ms": query_latency(lambda query: semantic.rank_movies(query,10),queries),
+                              "peak_rss_mb": peak_rss_mb()}
+        del semantic
+
+        if "hybrid" in components:
+            from lib.hybrid_search import HybridSearch
+            start = time.perf_counter()
+            hybrid = HybridSearch(documents,model_name=SYNTHETIC_MODEL_NAME,model=encoder)
+            result["hybrid"] = {"load_s": time.perf_counter()-start,
+                                "query_ms": query_latency(lambda query: hybrid.rrf_search(query,60,10),queries),
+                                "peak_rss_mb": peak_rss_mb()}
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+def scaling_metrics(result):
+    # the numbers that should grow at most linearly with the corpus, as
+    # (name, value, unit) with unit "s", "ms" or None for counts and sizes
+    metrics = [("corpus.bytes",result["corpus"]["bytes"],None)]
+    if "bm25" in result:
+        metrics += [("bm25.build_s",result["bm25"]["build_s"],"s"),("bm25.load_s",result["bm25"]["load_s"],"s"),
+                    ("bm25.index_bytes",result["bm25"]["index_bytes"],None),
+                    ("bm25.impact_build_s",result["bm25"]["impact_build_s"],"s"),
+                    ("bm25.impact_index_bytes",result["bm25"]["impact_index_bytes"],None)]
+        metrics += [(f"bm25.{mode}.p50_ms",summary["p50"],"ms") for mode,summary in result["bm25"]["query_ms"].items()]
+    if "semantic" in result:
+        metrics += [("semantic.build_s",result["semantic"]["build_s"],"s"),("semantic.load_s",result["semantic"]["load_s"],"s"),
+                    ("semantic.embedding_bytes",result["semantic"]["embedding_bytes"],None),
+                    ("semantic.p50_ms",result["semantic"]["query_ms"]["p50"],"ms")]
+    if "hybrid" in result:
+        metrics += [("hybrid.load_s",result["hybrid"]["load_s"],"s"),("hybrid.p50_ms",result["hybrid"]["query_ms"]["p50"],"ms")]
+    metrics.append(("peak_rss_mb",result["peak_rss_mb"],None))
+    return metrics
+
+def scaling_exponents(results,limit=SCALING_EXPONENT_LIMIT):
+    # growth between consecutive sizes as an exponent: value ~ size**e, so
+    # 1 is linear. Times below the noise floor are not flagged
+    rows = []
+    for small,large in zip(results,results[1:]):
+        before = {name: (value,unit) for name,value,unit in scaling_metrics(small)}
+        for name,value,unit in scaling_metrics(large):
+            if name not in before or before[name][0] <= 0 or value <= 0:
+                continue
+            exponent = math.log(value/before[name][0])/math.log(large["size"]/small["size"])
+            ms = value*1000 if unit == "s" else value
+            noisy = unit is not None and ms < SCALING_NOISE_FLOOR_MS
+            rows.append({"metric": name, "from": small["size"], "to": large["size"], "exponent": exponent,
+                         "superlinear": exponent > limit and not noisy})
+    return rows
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark index builds and queries on synthetic corpora of growing size")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(BENCHMARK_SIZES), help="Corpus sizes in documents")
+    parser.add_argument("--components", nargs="+", choices=BENCHMARK_COMPONENTS, default=list(BENCHMARK_COMPONENTS), help="What to benchmark")
+    parser.add_argument("--queries", type=int, default=100, help="Synthetic queries timed per component")
+    parser.add_argument("--dimensions", type=int, default=384, help="Dimensions of the synthetic embeddings")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus, queries and embeddings")
+    parser.add_argument("--max-exponent", type=float, default=SCALING_EXPONENT_LIMIT, help="Growth exponent above which a metric counts as super-linear")
+    parser.add_argument("--workdir", type=str, help="Directory for the generated corpora and caches (kept); a temporary one otherwise")
+    parser.add_argument("--output", type=str, help="Write the results as JSON to this file")
+    parser.add_argument("--run-size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_size is not None:
+        json.dump(measure_size(args.run_size,args.components,args.queries,args.dimensions,args.seed),sys.stdout)
+        return
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="ragsearch-scaling-")
+    results = []
+    try:
+        for size in sorted(args.sizes):
+            # one process per size, so peak RSS belongs to that size alone
+            size_dir = os.path.join(workdir,str(size))
+            os.makedirs(size_dir,exist_ok=True)
+            command = [sys.executable,os.path.abspath(__file__),"--run-size",str(size),"--components",*args.components,
+                       "--queries",str(args.queries),"--dimensions",str(args.dimensions),"--seed",str(args.seed)]
+            completed = subprocess.run(command,cwd=size_dir,capture_output=True,text=True)
+            if completed.returncode != 0:
+                raise RuntimeError(f"benchmark of {size} documents failed:\n{completed.stderr}")
+            result = json.loads(completed.stdout)
+            results.append(result)
+            print(f"{size:>9} docs  peak RSS {result['peak_rss_mb']:8.1f} MB")
+            for name,value,unit in scaling_metrics(result):
+                print(f"    {name:28} {value:14.4f}" if unit else f"    {name:28} {value:14.0f}")
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir,ignore_errors=True)
+
+    exponents = scaling_exponents(results,args.max_exponent)
+    if exponents:
+        print("\nGrowth exponents (1.0 = linear):")
+        for row in exponents:
+            flag = "  SUPER-LINEAR" if row["superlinear"] else ""
+            print(f"    {row['metric']:28} {row['from']:>9} -> {row['to']:<9} {row['exponent']:6.2f}{flag}")
+
+    if args.output:
+        with open(args.output,"w") as f:
+            json.dump({"config": {"sizes": sorted(args.sizes), "components": args.components, "queries": args.queries,
+                                  "dimensions": args.dimensions, "seed": args.seed, "max_exponent": args.max_exponent},
+                       "results": results, "scaling": exponents},f,indent=2)
+        print(f"Results written to {args.output}")
+
+    superlinear = [row for row in exponents if row["superlinear"]]
+    if superlinear:
+        print(f"{len(superlinear)} metrics grew faster than size**{args.max_exponent}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
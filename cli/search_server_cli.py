@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+
+from constants import *
+from lib.search_client import SearchClient, server_url
+from lib.search_service import SearchService, serve
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Resident search server shared by the search CLIs")
+    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+    serve_parser = subparsers.add_parser("serve", help="Load indexes and models once and answer searches over localhost HTTP")
+    serve_parser.add_argument("--host", type=str, default=SEARCH_SERVER_HOST, help="Address to bind")
+    serve_parser.add_argument("--port", type=int, default=SEARCH_SERVER_PORT, help="Port to listen on")
+    serve_parser.add_argument("--lazy", action="store_true", help="Load indexes and models on first use instead of at startup")
+    status_parser = subparsers.add_parser("status", help="Show what a running server has loaded")
+    status_parser.add_argument("--server", type=str, default=None, help="Server URL")
+    stop_parser = subparsers.add_parser("stop", help="Stop a running server")
+    stop_parser.add_argument("--server", type=str, default=None, help="Server URL")
+
+    args = parser.parse_args()
+
+    match args.command:
+        case "serve":
+            service = SearchService()
+            if not args.lazy:
+                print("loading indexes and models...")
+                service.warm()
+            print(f"search server listening on http://{args.host}:{args.port}")
+            print(f"point the CLIs at it with --server or {SEARCH_SERVER_ENV}=http://{args.host}:{args.port}")
+            try:
+                serve(service,args.host,args.port)
+            except KeyboardInterrupt:
+                pass
+
+        case "status":
+            client = SearchClient(server_url(args.server) or f"http://{SEARCH_SERVER_HOST}:{SEARCH_SERVER_PORT}")
+            print(json.dumps(client.call("status"),indent=2))
+
+        case "stop":
+            client = SearchClient(server_url(args.server) or f"http://{SEARCH_SERVER_HOST}:{SEARCH_SERVER_PORT}")
+            print(client.call("shutdown"))
+
+        case _:
+            parser.print_help()
+
+if __name__ == "__main__":
+    main()
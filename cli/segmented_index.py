@@ -0,0 +1,297 @@
+import json
+import math
+import os
+import threading
+
+import numpy as np
+
+from collections import Counter
+from collections.abc import Mapping
+from constants import *
+from inverted_index import BM25_MODES, InvertedIndex, bm25_tf_component, top_k_positions
+from preprocessing import preprocess
+
+class Segment():
+    # an immutable index file plus the external ids deleted from it since it
+    # was written; tombstones only ever grow until the segment is merged away
+    def __init__(self,name,index,deleted=()):
+        self.name = name
+        self.index = index
+        self.deleted = frozenset(deleted)
+        self.live = np.ones(index.total_docs,dtype=bool)
+        if self.deleted:
+            positions = np.searchsorted(index.doc_ids,sorted(self.deleted),sorter=index.doc_id_order)
+            self.live[index.doc_id_order[positions]] = False
+        self.live_docs = int(self.live.sum())
+        self.live_length = int(index.doc_lengths[self.live].sum())
+
+    def with_deleted(self,doc_ids):
+        hits = {doc_id for doc_id in doc_ids if doc_id not in self.deleted and doc_id in self.index.docmap}
+        if not hits:
+            return self
+        return Segment(self.name,self.index,self.deleted | hits)
+
+class SegmentedIndex():
+    def __init__(self,directory="cache/segments"):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory,"manifest.json")
+        self.generation = 0
+        self.segments = []
+        self.docmap = SegmentedDocuments(self)
+        # lock guards the segment list and manifest; merge_lock keeps a single
+        # merge running. Writers are expected to live in one process.
+        self.lock = threading.RLock()
+        self.merge_lock = threading.Lock()
+        self.merge_thread = None
+
+    def __segment_path(self,name):
+        return os.path.join(self.directory,name)
+
+    def __open_segment(self,name,verify=False):
+        index = InvertedIndex()
+        index.index_path = self.__segment_path(name)
+        index.load(verify)
+        return index
+
+    def __write_segment(self,name,index):
+        # a segment is checked against its payload checksum once, as written
+        index.index_path = self.__segment_path(name)
+        index.save()
+        return self.__open_segment(name,verify=True)
+
+    def __next_name(self):
+        with self.lock:
+            self.generation += 1
+            return f"segment_{self.generation:06d}.bin"
+
+    def __commit(self,segments):
+        # the manifest is the only mutable file; swapping it in atomically
+        # makes a new segment set visible to every reader at once
+        manifest = {"generation": self.generation,
+                    "segments": [{"name": s.name, "deleted": sorted(s.deleted)} for s in segments]}
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path,"w") as f:
+            json.dump(manifest,f)
+        os.replace(tmp_path,self.manifest_path)
+
+        removed = {s.name for s in self.segments} - {s.name for s in segments}
+        self.segments = segments
+        for name in removed:
+            os.remove(self.__segment_path(name))
+
+    def load(self):
+        try:
+            with open(self.manifest_path,"r") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            raise FileNotFoundError("Segment manifest not found. Run build first.")
+
+        with self.lock:
+            opened = {s.name: s.index for s in self.segments}
+            segments = []
+            for entry in manifest["segments"]:
+                index = opened.get(entry["name"]) or self.__open_segment(entry["name"])
+                segments.append(Segment(entry["name"],index,entry["deleted"]))
+            self.generation = max(self.generation,manifest["generation"])
+            self.segments = segments
+
+    def is_stale(self):
+        # segments are fed through the update APIs rather than built from
+        # data/movies.json, so only a change of the BM25 constants matters
+        with self.lock:
+            return any(s.index.bm25_params != (BM25_K1,BM25_B) for s in self.segments)
+
+    def build(self,documents,stopwords=None):
+        os.makedirs(self.directory,exist_ok=True)
+        index = InvertedIndex()
+        index.build(documents,stopwords)
+        name = self.__next_name()
+        segment = Segment(name,self.__write_segment(name,index))
+        with self.lock:
+            self.__commit([segment])
+
+    def add_documents(self,documents,stopwords=None,background_merge=True):
+        # upsert: the new segment holds the latest version of every document
+        # and older copies elsewhere are tombstoned in the same commit
+        documents = list({movie["id"]: movie for movie in documents}.values())
+        if not documents:
+            return
+        os.makedirs(self.directory,exist_ok=True)
+        index = InvertedIndex()
+        index.build(documents,stopwords)
+        name = self.__next_name()
+        segment = Segment(name,self.__write_segment(name,index))
+
+        doc_ids = [movie["id"] for movie in documents]
+        with self.lock:
+            segments = [s.with_deleted(doc_ids) for s in self.segments]
+            self.__commit(segments + [segment])
+        self.maybe_merge(background_merge)
+
+    def update_documents(self,documents,stopwords=None,background_merge=True):
+        self.add_documents(documents,stopwords,background_merge)
+
+    def delete_documents(self,doc_ids,background_merge=True):
+        with self.lock:
+            self.__commit([s.with_deleted(doc_ids) for s in self.segments])
+        self.maybe_merge(background_merge)
+
+    def merge_candidates(self):
+        # segments that are mostly tombstones are rewritten on their own; past
+        # SEGMENT_MAX_COUNT the smallest SEGMENT_MERGE_FACTOR are folded together
+        with self.lock:
+            segments = list(self.segments)
+        names = {s.name for s in segments if s.deleted and s.live_docs*2 <= s.index.total_docs}
+        if len(segments) > SEGMENT_MAX_COUNT:
+            smallest = sorted(segments,key=lambda s: s.live_docs)[:SEGMENT_MERGE_FACTOR]
+            names.update(s.name for s in smallest)
+        return names
+
+    def maybe_merge(self,background=True):
+        if not self.merge_candidates():
+            return
+        if not background:
+            self.merge()
+        elif self.merge_thread is None or not self.merge_thread.is_alive():
+            self.merge_thread = threading.Thread(target=self.merge,daemon=True)
+            self.merge_thread.start()
+
+    def merge(self,names=None):
+        with self.merge_lock:
+            with self.lock:
+                if names is None:
+                    names = self.merge_candidates()
+                chosen = [s for s in self.segments if s.name in names]
+            if not chosen or (len(chosen) == 1 and not chosen[0].deleted):
+                return False
+
+            name = self.__next_name()
+            merged = self.__write_segment(name,merge_segments(chosen))
+
+            with self.lock:
+                current = {s.name: s for s in self.segments}
+                # deletes that landed while merging still apply to the merged docs
+                late = set()
+                for s in chosen:
+                    late |= current[s.name].deleted - s.deleted
+                segment = Segment(name,merged).with_deleted(late)
+
+                segments = []
+                for s in self.segments:
+                    if s.name == chosen[0].name:
+                        segments.append(segment)
+                    elif s.name not in names:
+                        segments.append(s)
+                self.__commit(segments)
+            return True
+
+    def wait_for_merge(self):
+        if self.merge_thread is not None:
+            self.merge_thread.join()
+
+    def bm25_search(self,query,limit,mode="exhaustive"):
+        if mode not in BM25_MODES:
+            raise ValueError(f"Unknown BM25 search mode '{mode}', expected one of {BM25_MODES}")
+        with self.lock:
+            segments = list(self.segments)
+        if len(segments) == 1 and not segments[0].deleted:
+            # segments are written without impact scores, so that mode is
+            # served exhaustively like the several segment case below
+            index = segments[0].index
+            return index.bm25_search(query,limit,"exhaustive" if mode == "impact" and index.impacts is None else mode)
+
+        # the pruned and impact modes rely on per-segment statistics, so
+        # several segments are always scored exhaustively with global ones
+        tokens = Counter(preprocess(query))
+        total_docs = sum(s.live_docs for s in segments)
+        if total_docs == 0 or limit <= 0:
+            return []
+        avg_doc_length = sum(s.live_length for s in segments)/total_docs
+        if avg_doc_length == 0:
+            return []
+
+        doc_freqs = Counter()
+        segment_postings = []
+        for segment in segments:
+            postings = {}
+            for token in tokens:
+                found = segment.index.term_postings(token)
+                if found is None:
+                    continue
+                docs,tfs = found
+                if segment.deleted:
+                    live = segment.live[docs]
+                    docs,tfs = docs[live],tfs[live]
+                postings[token] = (docs,tfs)
+                doc_freqs[token] += len(docs)
+            segment_postings.append(postings)
+        idf = {token: math.log((total_docs-df+0.5)/(df+0.5)+1) for token,df in doc_freqs.items()}
+
+        ranked = []
+        for rank,(segment,postings) in enumerate(zip(segments,segment_postings)):
+            index = segment.index
+            scores = np.zeros(index.total_docs,dtype=np.float64)
+            for token,count in tokens.items():
+                if token not in postings:
+                    continue
+                docs,tfs = postings[token]
+                scores[docs] += count * idf[token] * bm25_tf_component(tfs,index.doc_lengths[docs],avg_doc_length,BM25_K1,BM25_B)
+            scores[~segment.live] = -np.inf
+            for pos in top_k_positions(scores,limit):
+                if scores[pos] == -np.inf:
+                    break
+                ranked.append((-scores[pos],rank,pos,int(index.doc_ids[pos])))
+
+        ranked.sort()
+        return [(doc_id,float(-score)) for score,_,_,doc_id in ranked[:limit]]
+
+def merge_segments(segments):
+    # concatenates the live postings of segments into one index without
+    # re-tokenizing; tombstoned documents are dropped for good
+    term_lookup = {}
+    term_ids,docs,tfs,doc_ids,doc_lengths = [],[],[],[],[]
+    docmap = {}
+    offset = 0
+    for segment in segments:
+        index = segment.index
+        live = segment.live
+        new_positions = np.cumsum(live)-1+offset
+        segment_terms = np.array([term_lookup.setdefault(term,len(term_lookup)) for term in index.terms()],dtype=np.int32)
+        posting_terms = np.repeat(segment_terms,np.diff(index.postings_offsets))
+        keep = live[index.postings_docs]
+
+        term_ids.append(posting_terms[keep])
+        docs.append(new_positions[index.postings_docs[keep]])
+        tfs.append(index.postings_tfs[keep])
+        doc_ids.append(index.doc_ids[live])
+        doc_lengths.append(index.doc_lengths[live])
+        for doc_id in index.doc_ids[live].tolist():
+            docmap[doc_id] = index.docmap[doc_id]
+        offset += segment.live_docs
+
+    # terms whose postings were all deleted do not survive the merge
+    used,term_ids = np.unique(np.concatenate(term_ids),return_inverse=True)
+    terms = list(term_lookup)
+    merged = InvertedIndex()
+    merged.assemble([terms[i] for i in used.tolist()],term_ids,np.concatenate(docs),np.concatenate(tfs),
+                    np.concatenate(doc_ids),np.concatenate(doc_lengths),docmap)
+    return merged
+
+class SegmentedDocuments(Mapping):
+    def __init__(self,index):
+        self.index = index
+
+    def __getitem__(self,doc_id):
+        for segment in reversed(self.index.segments):
+            if doc_id not in segment.deleted and doc_id in segment.index.docmap:
+                return segment.index.docmap[doc_id]
+        raise KeyError(doc_id)
+
+    def __iter__(self):
+        for segment in self.index.segments:
+            for doc_id in segment.index.docmap:
+                if doc_id not in segment.deleted:
+                    yield doc_id
+
+    def __len__(self):
+        return sum(s.live_docs for s in self.index.segments)
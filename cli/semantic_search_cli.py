@@ -5,6 +5,9 @@ import re
 
 from lib.semantic_search import *
 from lib.chunked_semantic_search import *
+from lib.ann_index import ann_recall_command
+from lib.quantized_embeddings import EMBEDDING_STORAGE, QuantizedEmbeddings
+from lib.search_client import RemoteChunkedSemanticSearch, SearchClient, server_url
 
 def main():
     parser = argparse.ArgumentParser(description="Semantic Search CLI")
@@ -18,6 +21,9 @@ def main():
     search_parser = subparsers.add_parser("search",help="Search documents on query")
     search_parser.add_argument("query",type=str,help="query to search")
     search_parser.add_argument("--limit", type=int,default=5,help="optional limit character")
+    search_parser.add_argument("--storage",type=str,choices=EMBEDDING_STORAGE,default="float32",help="embedding storage to search on")
+    search_parser.add_argument("--no-rescore",action="store_true",help="rank on compressed codes only, without exact rescoring")
+    search_parser.add_argument("--server",type=str,default=None,help=f"search through a running search server (default: ${SEARCH_SERVER_ENV})")
     chunk_parser = subparsers.add_parser("chunk",help="chunk a text")
     chunk_parser.add_argument("text",type=str,help="text to chunk")
     chunk_parser.add_argument("--chunk-size",type=int,default=200,help="chunk size for text")
@@ -30,6 +36,18 @@ def main():
     search_chunked = subparsers.add_parser("search_chunked",help="Chunks to search")
     search_chunked.add_argument("query",type=str,help="query used to search by chunks")
     search_chunked.add_argument("--limit",type=int,default=5,help="limit")
+    search_chunked.add_argument("--nprobe",type=int,default=None,help="search the ANN index, scanning this many lists (default: exact search)")
+    search_chunked.add_argument("--storage",type=str,choices=EMBEDDING_STORAGE,default="float32",help="embedding storage to search on")
+    search_chunked.add_argument("--no-rescore",action="store_true",help="rank on compressed codes only, without exact rescoring")
+    search_chunked.add_argument("--server",type=str,default=None,help=f"search through a running search server (default: ${SEARCH_SERVER_ENV})")
+    quantize_parser = subparsers.add_parser("quantize",help="build compressed copies of the saved embeddings")
+    quantize_parser.add_argument("--storage",type=str,choices=EMBEDDING_STORAGE[1:],nargs="+",default=list(EMBEDDING_STORAGE[1:]),help="storage modes to build")
+    build_ann_parser = subparsers.add_parser("build_ann",help="build the IVF index over the chunk embeddings")
+    build_ann_parser.add_argument("--lists",type=int,default=None,help="number of IVF lists (default: scales with sqrt of the chunk count)")
+    ann_recall_parser = subparsers.add_parser("ann_recall",help="measure ANN recall and latency against exact search")
+    ann_recall_parser.add_argument("--nprobe",type=int,nargs="+",default=[1,2,4,8,16,32],help="nprobe values to measure")
+    ann_recall_parser.add_argument("--queries",type=int,default=200,help="number of sampled queries")
+    ann_recall_parser.add_argument("--limit",type=int,default=10,help="k of recall@k")
     args = parser.parse_args()
 
     match args.command:
@@ -46,10 +64,14 @@ def main():
             embed_query_text(args.query)
 
         case "search":
-            searcher = SemanticSearch()
-            with open("data/movies.json", "r") as f:
-                documents = json.load(f)
-            searcher.load_or_create_embeddings(documents["movies"])
+            url = server_url(args.server)
+            if url:
+                searcher = RemoteChunkedSemanticSearch(SearchClient(url))
+            else:
+                searcher = SemanticSearch(storage=args.storage,rescore=not args.no_rescore,query_cache_path=QUERY_CACHE_PATH)
+                with open("data/movies.json", "r") as f:
+                    documents = json.load(f)
+                searcher.load_or_create_embeddings(documents["movies"])
             results = searcher.search(args.query,args.limit)
             for i,result in enumerate(results,start=1):
                 print(f"{i}. {result['title']} (score: {result['score']:.4f})")
@@ -88,19 +110,50 @@ def main():
             chunked = ChunkedSemanticSearch()
             chunked.load_or_create_chunk_embeddings(documents["movies"])
             print(f"Generated {len(chunked.chunk_embeddings)} chunked embeddings")
+            stats = chunked.embedding_stats
+            print(f"Encoded {stats['encoded']}, reused {stats['reused']}, dropped {stats['dropped']}")
 
         case "search_chunked":
-            with open("data/movies.json", "r") as f:
-                documents = json.load(f)
-            search = ChunkedSemanticSearch()
-            search.load_or_create_chunk_embeddings(documents["movies"])
+            url = server_url(args.server)
+            if url:
+                search = RemoteChunkedSemanticSearch(SearchClient(url))
+            else:
+                with open("data/movies.json", "r") as f:
+                    documents = json.load(f)
+                search = ChunkedSemanticSearch(storage=args.storage,rescore=not args.no_rescore,query_cache_path=QUERY_CACHE_PATH)
+                search.load_or_create_chunk_embeddings(documents["movies"])
+                if args.nprobe is not None:
+                    search.load_or_create_ann_index()
 
-            results = search.search_chunks(args.query,args.limit)
+            results = search.search_chunks(args.query,args.limit,args.nprobe)
 
             for i,result in enumerate(results,1):
                 print(f"\n{i}. {result['title']} (score: {result['score']:.4f})")
                 print(f"   {result['document']}...")
 
+        case "build_ann":
+            with open("data/movies.json", "r") as f:
+                documents = json.load(f)
+            search = ChunkedSemanticSearch()
+            search.load_or_create_chunk_embeddings(documents["movies"])
+            index = search.load_or_create_ann_index(args.lists,rebuild=True)
+            print(f"Built ANN index with {len(index.centroids)} lists over {len(search.chunk_embeddings)} chunks")
+
+        case "quantize":
+            for path in ("cache/movie_embeddings.npy","cache/chunk_embeddings.npy"):
+                if not os.path.exists(path):
+                    print(f"{path} not found, skipping")
+                    continue
+                full = np.load(path,mmap_mode="r")
+                for storage in args.storage:
+                    quantized = QuantizedEmbeddings(path,storage)
+                    quantized.build()
+                    quantized.save()
+                    print(f"{quantized.path}: {quantized.nbytes/2**20:.2f} MiB ({full.nbytes/max(1,quantized.nbytes):.1f}x smaller than float32)")
+
+        case "ann_recall":
+            ann_recall_command(args.nprobe,args.queries,args.limit)
+
         case _:
             parser.print_help()
 